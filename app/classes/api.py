@@ -5,10 +5,13 @@ import tornado.web
 import tornado.escape 
 import logging.config
 
-from app.classes.models import Roles, Users, check_role_permission, Remote, model_to_dict
+from app.classes.models import Roles, Users, check_role_permission, model_to_dict, permission_cache
 from app.classes.multiserv import multi
 from app.classes.helpers import helper
 from app.classes.backupmgr import backupmgr
+from app.classes.exporter import exporter, CONTENT_TYPE
+from app.classes.command_queue import command_queue
+from app.classes.token_cache import api_token_cache
 
 logger = logging.getLogger(__name__)
 
@@ -33,22 +36,15 @@ class BaseHandler(tornado.web.RequestHandler):
         self.finish(self.return_response(403, {'error':'ACCESS_DENIED'}, {}, {'info':'You were denied access to the requested resource'}))
     
     def authenticate_user(self, token):
+        """
+        Returns:
+            string: the username the API token belongs to, or None if it isn't a valid token
+        """
         try:
-            logger.debug("Searching for specified token")
-            user_data = Users.get(api_token=token)
-            logger.debug("Checking results")
-            if user_data:
-                # Login successful! Return the username
-                logger.info("User {} has authenticated to API".format(user_data.username))
-                return user_data.username
-            else:
-                logging.debug("Auth unsuccessful")
-                return None
-                
-        except:
-            logger.warning("Traceback occurred when authenticating user to API. Most likely wrong token")
+            return api_token_cache.authenticate(token)
+        except Exception:
+            logger.exception("Unable to authenticate user to API. Traceback:")
             return None
-            pass
         
 class SendCommand(BaseHandler):
     
@@ -94,8 +90,35 @@ class GetHostStats(BaseHandler):
         
         stats = multi.get_host_status()
         stats.pop('time') # We dont need the request time 
+        stats['stats_tick'] = multi.get_stats_tick()
         self.return_response(200, {}, stats, {})
         
+class GetMetrics(BaseHandler):
+
+    def initialize(self, mcserver):
+        self.mcserver = mcserver
+
+    def get(self):
+        # scrapers usually send the token as a bearer token, but ?token= works like the rest of the api
+        token = self.get_argument('token', None)
+        auth_header = self.request.headers.get('Authorization', '')
+
+        if token is None and auth_header.startswith('Bearer '):
+            token = auth_header[len('Bearer '):].strip()
+
+        user = self.authenticate_user(token) if token else None
+
+        if user is None:
+            self.access_denied('unknown')
+            return
+
+        if not check_role_permission(user, 'api_access'):
+            self.access_denied(user)
+            return
+
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(exporter.render())
+
 class GetServerStats(BaseHandler):
     
     def initialize(self, mcserver):
@@ -121,6 +144,39 @@ class GetServerStats(BaseHandler):
             
         self.return_response(200, {}, data, {})
         
+class GetStartupHistory(BaseHandler):
+
+    def initialize(self, mcserver):
+        self.mcserver = mcserver
+
+    def get(self):
+        token = self.get_argument('token')
+        user = self.authenticate_user(token)
+
+        if user is None:
+            self.access_denied('unknown')
+            return
+
+        if not check_role_permission(user, 'api_access'):
+            self.access_denied(user)
+            return
+
+        server_id = self.get_argument('id')
+        server = multi.get_server_obj(server_id)
+
+        if server is None:
+            self.set_status(404)
+            self.return_response(404, {'error': 'SER_NOT_FOUND'}, {}, {'info': 'No server with that id'})
+            return
+
+        data = []
+
+        for startup in server.get_startup_history():
+            startup['time'] = startup['time'].strftime("%m/%d/%Y %H:%M:%S")
+            data.append(startup)
+
+        self.return_response(200, {}, data, {})
+
 class SearchMCLogs(BaseHandler):
     
     def initialize(self, mcserver):
@@ -270,11 +326,7 @@ class StartServer(BaseHandler):
         server = multi.get_server_obj(server_id)
             
         if not server.check_running():
-            Remote.insert({
-                Remote.command: 'start_mc_server',
-                Remote.server_id: server_id,
-                Remote.command_source: "localhost"
-            }).execute()
+            command_queue.put('start_mc_server', server_id, "localhost")
             self.return_response(200, {}, {'code':'SER_START_CALLED'}, {})
         else:
             self.return_response(500, {'error':'SER_RUNNING'}, {}, {})
@@ -298,11 +350,7 @@ class StopServer(BaseHandler):
         server = multi.get_server_obj(server_id)
         
         if server.check_running():
-            Remote.insert({
-                Remote.command: 'stop_mc_server',
-                Remote.server_id: server_id,
-                Remote.command_source: "localhost"
-            }).execute()
+            command_queue.put('stop_mc_server', server_id, "localhost")
             
             self.return_response(200, {}, {'code':'SER_STOP_CALLED'}, {})
         else:
@@ -355,6 +403,7 @@ class CreateUser(BaseHandler):
                 Users.password: helper.encode_pass(new_pass),
                 Users.api_token: new_token
             }).execute()
+            permission_cache.bump()
             
             self.return_response(200, {}, {'code':'COMPLETE', 'username': new_username, 'password': new_pass, 'api_token': new_token}, {})
         else:
@@ -379,6 +428,7 @@ class DeleteUser(BaseHandler):
         else:
             if username:
                 Users.delete().where(Users.username == username).execute()
+                permission_cache.bump()
                 self.return_response(200, {}, {'code':'COMPLETED'}, {})
                 
 class ListServers(BaseHandler):
@@ -0,0 +1,61 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class CommandQueue:
+    """
+    Commands waiting to be run by remote_commands, in the order they were sent
+
+    Anything in this process puts commands here directly, and they are picked up as soon as they
+    arrive. Other processes (such as crafty.py -k) can't reach this, so they write to the Remote
+    table instead, and remote_commands moves those rows in here
+    """
+
+    def __init__(self):
+        self.commands = deque()
+        self.condition = threading.Condition()
+
+    def put(self, command, server_id, source='local'):
+        """
+        Queues a command for remote_commands to run
+
+        Args:
+            command (string): one of the commands in remote_coms.commands
+            server_id (int): the server it is for, Crafty wide commands still pass one
+            source (string): who asked, for logging
+        """
+        with self.condition:
+            self.commands.append({
+                'command': command,
+                'server_id': server_id,
+                'command_source': source
+            })
+            self.condition.notify()
+
+        logger.debug("Queued command %s for server %s from %s", command, server_id, source)
+
+    def get(self, timeout=None):
+        """
+        Waits for the next command
+
+        Args:
+            timeout (float): seconds to wait, None = wait forever
+
+        Returns:
+            dict: command, server_id and command_source, or None if we timed out
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.commands, timeout):
+                return None
+
+            return self.commands.popleft()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.commands)
+
+
+command_queue = CommandQueue()
@@ -0,0 +1,136 @@
+import threading
+import logging
+from itertools import islice
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ConsoleBuffer:
+
+    def __init__(self, max_lines=1000):
+        # a fixed size ring buffer - old lines fall off the front as new ones come in
+        # each entry is a (sequence number, line) tuple, sequence numbers only ever go up
+        self.lines = deque(maxlen=max_lines)
+        self.last_seq = 0
+        self.lock = threading.Lock()
+
+        # callables that get (seq, line) for every new line, such as open websockets
+        self.listeners = []
+
+    def append(self, line):
+        with self.lock:
+            self.last_seq += 1
+            seq = self.last_seq
+            self.lines.append((seq, line))
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            try:
+                listener(seq, line)
+            except Exception:
+                logger.exception("Console listener %s failed. Traceback:", listener)
+
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    def seed(self, lines):
+        """
+        Fills an empty buffer with lines read from somewhere else (such as latest.log)
+
+        Does nothing if the buffer has ever had a line in it, so we only pay for the read once
+
+        Args:
+            lines (list): lines to add, oldest first
+
+        Returns:
+            bool: True = buffer was seeded, False = buffer already had data
+        """
+        with self.lock:
+            if self.last_seq > 0:
+                return False
+
+            for line in lines:
+                self.last_seq += 1
+                self.lines.append((self.last_seq, line.rstrip('\r\n')))
+
+        return True
+
+    def get_lines(self, number_lines=None):
+        with self.lock:
+            lines = [line for seq, line in self.lines]
+
+        if number_lines is not None:
+            return lines[-number_lines:]
+
+        return lines
+
+    def get_lines_since(self, since=0):
+        """
+        Returns the lines added after a given sequence number
+
+        If the caller asks for a sequence number we have never handed out (we were restarted)
+        we send everything we have, and flag it so the caller knows to start over
+
+        Args:
+            since (int): the last sequence number the caller has seen
+
+        Returns:
+            dict: seq = newest sequence number, lines = new lines, reset = caller should drop what it has
+        """
+        with self.lock:
+            last_seq = self.last_seq
+            reset = since > last_seq
+
+            if reset or not self.lines:
+                lines = [line for seq, line in self.lines]
+            else:
+                # sequence numbers are contiguous, so we can work out where to start without searching
+                first_seq = self.lines[0][0]
+                start = max(since - first_seq + 1, 0)
+                lines = [line for seq, line in islice(self.lines, start, None)]
+
+        return {
+            'seq': last_seq,
+            'lines': lines,
+            'reset': reset
+        }
+
+    def clear(self):
+        with self.lock:
+            self.lines.clear()
+
+    def read_stream(self, stream, name=None):
+        """
+        Drains a binary stream (such as a process stdout) line by line into the buffer
+
+        This blocks until the stream is closed, so it is meant to run in its own thread
+
+        Args:
+            stream (file): the stream to read from
+            name (string): used for logging only
+        """
+        logger.debug("Console reader started for %s", name)
+
+        try:
+            for raw_line in iter(stream.readline, b''):
+                self.append(raw_line.decode('utf-8', errors='replace').rstrip('\r\n'))
+        except (OSError, ValueError):
+            # the pipe was closed under us - the process is gone
+            pass
+
+        logger.debug("Console reader finished for %s", name)
+
+    def start_reader(self, stream, name=None):
+        reader = threading.Thread(target=self.read_stream,
+                                  args=(stream, name),
+                                  daemon=True,
+                                  name="console_reader_{}".format(name))
+        reader.start()
+        return reader
@@ -9,6 +9,7 @@ from app.classes.console import console
 from app.classes.helpers import helpers
 from app.classes.models import Remote, MC_settings, Webserver, model_to_dict, Users
 from app.classes.multiserv import multi
+from app.classes.command_queue import command_queue
 
 helper = helpers()
 
@@ -125,11 +126,7 @@ class MainPrompt(cmd.Cmd):
             else:
                 console.info("Starting Minecraft Server in background")
 
-                Remote.insert({
-                    Remote.command: 'start_mc_server',
-                    Remote.server_id: server,
-                    Remote.command_source: "localhost"
-                }).execute()
+                command_queue.put('start_mc_server', server, "localhost")
 
         else:
             console.warning("Unable to start server, please complete setup in the web GUI first")
@@ -161,11 +158,7 @@ class MainPrompt(cmd.Cmd):
 
         server = int(line)
 
-        Remote.insert({
-            Remote.command: 'restart_mc_server',
-            Remote.server_id: server,
-            Remote.command_source: "localhost"
-        }).execute()
+        command_queue.put('restart_mc_server', server, "localhost")
 
         console.info("Restarting Minecraft Server in background")
 
@@ -269,6 +262,8 @@ class MainPrompt(cmd.Cmd):
             MC_settings.auto_start_server: False
         }).where(MC_settings.id == server).execute()
 
+        multi.reload_server_settings(server)
+
         logger.info("Disabled Autostart for Server {} via the console".format(server))
         console.info("Disabled Autostart for Server {} ".format(server))
 
@@ -303,15 +298,13 @@ class MainPrompt(cmd.Cmd):
             MC_settings.auto_start_server: True
         }).where(MC_settings.id == server).execute()
 
+        multi.reload_server_settings(server)
+
         logger.info("Enabled Autostart for Server {} via the console".format(server))
         console.info("Enabled Autostart for Server {} ".format(server))
 
     def do_reload_webserver(self, line):
-        Remote.insert({
-            Remote.command: 'restart_web_server',
-            Remote.server_id: 1,
-            Remote.command_source: 'localhost'
-        }).execute()
+        command_queue.put('restart_web_server', 1, 'localhost')
         console.info("Reloading Tornado Webserver, Please wait 5 seconds to reconnect")
 
     def help_reload_webserver(self):
@@ -421,11 +414,7 @@ class MainPrompt(cmd.Cmd):
 
             console.info("Updating Server Jar in background")
 
-            Remote.insert({
-                Remote.command: 'update_server_jar_console',
-                Remote.server_id: server,
-                Remote.command_source: "localhost"
-            }).execute()
+            command_queue.put('update_server_jar_console', server, "localhost")
         else:
             console.warning("Unable to update server jar, please complete setup in the web GUI first")
 
@@ -462,11 +451,7 @@ class MainPrompt(cmd.Cmd):
 
             console.info("Reverting updated Server Jar in background")
 
-            Remote.insert({
-                Remote.command: 'revert_server_jar_console',
-                Remote.server_id: server,
-                Remote.command_source: "localhost"
-            }).execute()
+            command_queue.put('revert_server_jar_console', server, "localhost")
         else:
             console.warning("Unable to update server jar, please complete setup in the web GUI first")
 
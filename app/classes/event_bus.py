@@ -0,0 +1,53 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# events we publish - the keys are what subscribers pass to subscribe()
+events = {
+    "server_state_changed": "A Minecraft server moved from one lifecycle state to another",
+}
+
+
+class EventBus():
+
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, event, callback):
+        if event not in events:
+            logger.warning("Subscribing to unknown event %s", event)
+
+        with self.lock:
+            self.subscribers.setdefault(event, []).append(callback)
+
+    def unsubscribe(self, event, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(event, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def publish(self, event, **data):
+        """
+        Calls every subscriber of an event, in the thread that published it
+
+        A subscriber that raises is logged and skipped, it won't stop the others or the publisher
+
+        Args:
+            event (string): the event name, see events above
+            **data: passed to each subscriber as keyword arguments
+        """
+        with self.lock:
+            callbacks = list(self.subscribers.get(event, []))
+
+        logger.debug("Publishing event %s to %s subscriber(s): %s", event, len(callbacks), data)
+
+        for callback in callbacks:
+            try:
+                callback(**data)
+            except Exception:
+                logger.exception("Subscriber %s failed handling event %s. Traceback:", callback, event)
+
+
+event_bus = EventBus()
@@ -0,0 +1,126 @@
+import logging
+
+from app.classes.multiserv import multi
+from app.classes.minecraft_server import STATE_STOPPED, STATE_STARTING, STATE_RUNNING, STATE_STOPPING, STATE_CRASHED, STATE_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+ALL_STATES = (STATE_STOPPED, STATE_STARTING, STATE_RUNNING, STATE_STOPPING, STATE_CRASHED, STATE_BACKOFF)
+
+# name -> (type, help)
+SERVER_METRICS = {
+    'crafty_server_up': ('gauge', 'Whether the server process is alive (starting, running or stopping)'),
+    'crafty_server_state': ('gauge', 'The lifecycle state the server is in, 1 for the current state'),
+    'crafty_server_crashed': ('gauge', 'Whether the server has crashed (crashed or waiting to restart)'),
+    'crafty_server_cpu_percent': ('gauge', 'Server process CPU usage as a percent of the whole host'),
+    'crafty_server_memory_rss_bytes': ('gauge', 'Server process resident memory'),
+    'crafty_server_players_online': ('gauge', 'Players online, from the last ping'),
+    'crafty_server_players_max': ('gauge', 'Player slots, from the last ping'),
+    'crafty_server_world_size_bytes': ('gauge', 'Size of all region directories'),
+    'crafty_server_uptime_seconds': ('gauge', 'Seconds since the server process was launched'),
+    'crafty_server_restart_count': ('gauge', 'Crash restarts since the server was last started on purpose'),
+    'crafty_server_startup_seconds': ('gauge', 'How long the last startup took'),
+}
+
+HOST_METRICS = {
+    'crafty_host_cpu_percent': ('gauge', 'Host CPU usage averaged over all cores', 'cpu_usage'),
+    'crafty_host_cpu_cores': ('gauge', 'Logical CPU cores', 'cpu_cores'),
+    'crafty_host_cpu_frequency_mhz': ('gauge', 'Current CPU frequency', 'cpu_cur_freq'),
+    'crafty_host_memory_used_bytes': ('gauge', 'Host memory in use', 'mem_used'),
+    'crafty_host_memory_total_bytes': ('gauge', 'Host memory', 'mem_total'),
+    'crafty_host_disk_used_bytes': ('gauge', 'Used space on the root filesystem', 'disk_used'),
+    'crafty_host_disk_total_bytes': ('gauge', 'Size of the root filesystem', 'disk_total'),
+    'crafty_host_boot_time_seconds': ('gauge', 'When the host booted, as a unix timestamp', 'boot_time'),
+}
+
+TICK_METRICS = {
+    'crafty_stats_run_duration_seconds': ('gauge', 'How long the last server stats run took', 'duration'),
+    'crafty_stats_run_servers': ('gauge', 'Servers collected in the last stats run', 'servers'),
+    'crafty_stats_run_failed': ('gauge', 'Servers that failed in the last stats run', 'failed'),
+    'crafty_stats_run_timed_out': ('gauge', 'Servers that timed out in the last stats run', 'timed_out'),
+    'crafty_stats_run_skipped': ('gauge', 'Servers skipped in the last stats run (still busy from the one before)', 'skipped'),
+}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(key, escape_label(value)) for key, value in labels.items()) + '}'
+
+
+class MetricsExporter():
+    """
+    Renders what we already hold in memory in the Prometheus text format
+
+    Nothing here reads the database - server numbers come from the last stats run and the
+    server objects, host numbers from the last do_host_status run
+    """
+
+    def collect_servers(self):
+        # metric name -> list of (labels, value)
+        samples = {name: [] for name in SERVER_METRICS}
+        snapshot = multi.get_stats_snapshot()
+
+        for s in list(multi.servers_list.values()):
+            srv_obj = s['server_obj']
+            server_id = s['server_id']
+            labels = {'server_id': server_id, 'server_name': srv_obj.name}
+            stats = snapshot.get(int(server_id), {})
+
+            # the process numbers are fresher on the object than in the last stats run
+            usage = srv_obj.last_usage if srv_obj.check_running() else None
+
+            samples['crafty_server_up'].append((labels, int(srv_obj.check_running())))
+            samples['crafty_server_crashed'].append((labels, int(srv_obj.check_crashed())))
+
+            for state in ALL_STATES:
+                samples['crafty_server_state'].append((dict(labels, state=state), int(srv_obj.get_state() == state)))
+
+            samples['crafty_server_cpu_percent'].append((labels, usage['cpu_usage'] if usage else 0))
+            samples['crafty_server_memory_rss_bytes'].append((labels, usage['memory_bytes'] if usage else 0))
+            samples['crafty_server_players_online'].append((labels, stats.get('online', 0)))
+            samples['crafty_server_players_max'].append((labels, stats.get('max', 0)))
+            samples['crafty_server_world_size_bytes'].append((labels, stats.get('world_bytes', 0)))
+            samples['crafty_server_uptime_seconds'].append((labels, round(srv_obj.get_uptime(), 3)))
+            samples['crafty_server_restart_count'].append((labels, srv_obj.restart_count))
+
+            if srv_obj.last_startup_seconds is not None:
+                samples['crafty_server_startup_seconds'].append((labels, srv_obj.last_startup_seconds))
+
+        return samples
+
+    def render(self):
+        lines = []
+
+        def add(name, metric_type, help_text, values):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for labels, value in values:
+                lines.append("{}{} {}".format(name, format_labels(labels), value))
+
+        for name, values in self.collect_servers().items():
+            metric_type, help_text = SERVER_METRICS[name]
+            add(name, metric_type, help_text, values)
+
+        host = multi.get_host_snapshot()
+
+        for name, (metric_type, help_text, key) in HOST_METRICS.items():
+            if key in host:
+                add(name, metric_type, help_text, [({}, host[key])])
+
+        tick = multi.get_stats_tick()
+
+        for name, (metric_type, help_text, key) in TICK_METRICS.items():
+            add(name, metric_type, help_text, [({}, tick[key])])
+
+        return "\n".join(lines) + "\n"
+
+
+exporter = MetricsExporter()
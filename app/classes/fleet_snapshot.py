@@ -0,0 +1,41 @@
+import time
+import logging
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+
+def freeze(data):
+    """Returns a read only copy of a dict"""
+    return MappingProxyType(dict(data))
+
+
+class FleetSnapshot:
+    """
+    What the web pages show about every server, built once and shared by every request until the next one
+
+    multi builds a new one after each stats run and whenever a server is added, removed, renamed or changes
+    state, and swaps it in whole. Nothing in here can be changed - a handler that wants to adjust a value
+    has to copy it first
+
+    Attributes:
+        time (float): unix time the snapshot was built
+        servers_defined (tuple): one read only dict per server, as multi.list_servers() returns them
+        servers_running (tuple): id and name of each running server
+        mc_servers_data (mapping): server id -> read only stats row, as multi.get_stats_for_servers() returns them
+    """
+
+    __slots__ = ('time', 'servers_defined', 'servers_running', 'mc_servers_data')
+
+    def __init__(self, servers_defined=(), servers_running=(), mc_servers_data=None):
+        object.__setattr__(self, 'time', time.time())
+        object.__setattr__(self, 'servers_defined', tuple(freeze(s) for s in servers_defined))
+        object.__setattr__(self, 'servers_running', tuple(freeze(s) for s in servers_running))
+        object.__setattr__(self, 'mc_servers_data', freeze(
+            {server_id: freeze(stats) for server_id, stats in (mc_servers_data or {}).items()}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FleetSnapshot is read only")
+
+    def __delattr__(self, name):
+        raise AttributeError("FleetSnapshot is read only")
@@ -0,0 +1,563 @@
+import os
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+from stat import S_ISDIR, S_ISLNK
+
+logger = logging.getLogger(__name__)
+
+# how long a directory listing we can't get inotify events for is trusted before we read it again
+RESCAN_INTERVAL = 30
+
+# inotify constants, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# no IN_MODIFY - a running server writes its region files all the time, and file sizes are
+# picked up by the world size index's own rescans, not from these listings
+WATCH_MASK = (IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def load_inotify():
+    """
+    Loads the inotify functions out of libc
+
+    Returns:
+        ctypes.CDLL: libc, or None if we aren't on Linux or it has no inotify
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+def scan_dir(path):
+    """
+    Reads one directory from disk
+
+    Args:
+        path (string): the directory to read
+
+    Returns:
+        dict: file name -> {'is_dir', 'is_link', 'size', 'mtime'}
+    """
+    entries = {}
+
+    for entry in os.scandir(path):
+        try:
+            st = entry.stat()
+        except OSError:
+            # a broken symlink - report the link itself
+            st = entry.stat(follow_symlinks=False)
+
+        entries[entry.name] = {
+            'is_dir': entry.is_dir(),
+            'is_link': entry.is_symlink(),
+            'size': st.st_size,
+            'mtime': st.st_mtime
+        }
+
+    return entries
+
+
+def stat_path(path):
+    """
+    Reads one file or directory from disk
+
+    Args:
+        path (string): the path to look up
+
+    Returns:
+        dict: {'is_dir', 'is_link', 'size', 'mtime'} like a scan_dir() entry, or None if it doesn't exist
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+
+    is_link = S_ISLNK(st.st_mode)
+
+    if is_link:
+        try:
+            st = os.stat(path)
+        except OSError:
+            # a broken symlink - report the link itself
+            pass
+
+    return {
+        'is_dir': S_ISDIR(st.st_mode),
+        'is_link': is_link,
+        'size': st.st_size,
+        'mtime': st.st_mtime
+    }
+
+
+class DirTree:
+    """
+    What we know about every directory under one watched path
+    """
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+
+        # set once the first full walk has finished
+        self.ready = False
+
+        # directory path -> {'entries': scan_dir() result, 'scanned': monotonic time, 'dirty': bool, 'wd': watch or None,
+        #                    'seq': bumped each time a refresh starts, so an older, slower read can't overwrite a newer one}
+        self.nodes = {}
+
+    def fully_watched(self):
+        return self.ready and all(node['wd'] is not None for node in self.nodes.values())
+
+
+class FsWatcher:
+    """
+    Keeps an in memory copy of the directories under each watched path
+
+    On Linux every directory gets an inotify watch, and a listing is only read from disk again after
+    an event says it changed. Anything we couldn't watch (no inotify, or we hit fs.inotify.max_user_watches)
+    is read again when it is older than RESCAN_INTERVAL. Paths outside a watched tree go straight to disk,
+    so callers can always ask us instead of the disk
+    """
+
+    def __init__(self):
+        # guards the trees and watches only - nothing reads the disk while holding it
+        self.lock = threading.RLock()
+
+        # root path -> DirTree
+        self.trees = {}
+
+        # watch descriptor -> (DirTree, directory path)
+        self.wds = {}
+
+        self.libc = None
+        self.fd = None
+        self.reader = None
+        self.inotify_failed = False
+        self.degraded = False
+
+        # (DirTree, directory path) -> True, for walks waiting on the populate worker - a dict, so a directory
+        # that many events ask for is only queued once
+        self.pending = {}
+        self.pending_condition = threading.Condition()
+        self.populater = None
+
+    def start(self):
+        if self.fd is not None or self.inotify_failed:
+            return
+
+        libc = load_inotify()
+
+        if libc is None:
+            logger.info("inotify isn't available, watched directories will be rescanned every %s seconds", RESCAN_INTERVAL)
+            self.inotify_failed = True
+            return
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if fd < 0:
+            logger.warning("Unable to start inotify (%s), watched directories will be rescanned every %s seconds",
+                           os.strerror(ctypes.get_errno()), RESCAN_INTERVAL)
+            self.inotify_failed = True
+            return
+
+        self.libc = libc
+        self.fd = fd
+
+        self.reader = threading.Thread(target=self.read_events, daemon=True, name="fs_watcher")
+        self.reader.start()
+
+    def watch(self, root_path):
+        """
+        Starts keeping track of a directory tree - the first walk happens in the background
+
+        Args:
+            root_path (string): the directory to watch
+
+        Returns:
+            DirTree: the tree for this path
+        """
+        root_path = os.path.normpath(root_path)
+
+        with self.lock:
+            tree = self.trees.get(root_path)
+
+            if tree is not None:
+                return tree
+
+            self.start()
+
+            tree = DirTree(root_path)
+            self.trees[root_path] = tree
+
+        logger.debug("Watching %s", root_path)
+        self.queue_populate(tree, root_path)
+
+        return tree
+
+    def unwatch(self, root_path):
+        root_path = os.path.normpath(root_path)
+
+        with self.lock:
+            tree = self.trees.pop(root_path, None)
+
+            if tree is not None:
+                self.drop_node(tree, root_path)
+                logger.debug("Stopped watching %s", root_path)
+
+    def queue_populate(self, tree, path):
+        """
+        Asks the populate worker to walk a directory - every walk runs on that one thread, in the order asked for
+        """
+        with self.pending_condition:
+            self.pending[(tree, path)] = True
+
+            if self.populater is None:
+                self.populater = threading.Thread(target=self.run_populate, daemon=True, name="fs_watcher_populate")
+                self.populater.start()
+
+            self.pending_condition.notify()
+
+    def run_populate(self):
+        while True:
+            with self.pending_condition:
+                self.pending_condition.wait_for(lambda: self.pending)
+
+                key = next(iter(self.pending))
+                del self.pending[key]
+
+            tree, path = key
+
+            try:
+                self.populate(tree, path)
+            except Exception:
+                logger.exception("Unable to read %s. Traceback:", path)
+
+    def populate(self, tree, path):
+        stack = [path]
+
+        while stack:
+            dir_path = stack.pop()
+
+            # unwatched while we were walking it
+            if self.trees.get(tree.root_path) is not tree:
+                return
+
+            entries = self.refresh_node(tree, dir_path)
+
+            if entries is not None:
+                stack.extend(os.path.join(dir_path, name) for name, entry in entries.items()
+                             if entry['is_dir'] and not entry['is_link'])
+
+        if path == tree.root_path:
+            tree.ready = True
+            logger.debug("Finished reading %s directories under %s", len(tree.nodes), tree.root_path)
+
+    def add_watch(self, tree, path):
+        if self.fd is None:
+            return None
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+
+        if wd < 0:
+            err = ctypes.get_errno()
+
+            if err == errno.ENOSPC:
+                if not self.degraded:
+                    logger.warning("Reached the inotify watch limit (fs.inotify.max_user_watches), "
+                                   "unwatched directories will be rescanned every %s seconds", RESCAN_INTERVAL)
+                self.degraded = True
+            else:
+                logger.debug("Unable to watch %s: %s", path, os.strerror(err))
+
+            return None
+
+        self.wds[wd] = (tree, path)
+        return wd
+
+    def refresh_node(self, tree, path):
+        """
+        Reads one directory from disk into the tree - the lock is only held around the bookkeeping, not the read
+
+        Returns:
+            dict: the fresh entries, or None if the directory is gone or the tree was unwatched
+        """
+        with self.lock:
+            if self.trees.get(tree.root_path) is not tree:
+                return None
+
+            node = tree.nodes.get(path)
+
+            if node is None:
+                node = {'entries': {}, 'scanned': 0, 'dirty': True, 'wd': None, 'seq': 0}
+                tree.nodes[path] = node
+
+            # watch before we read, so a change can't slip in between the two
+            if node['wd'] is None:
+                node['wd'] = self.add_watch(tree, path)
+
+            # an event that arrives while we read sets this again, so the next caller reads it again
+            node['dirty'] = False
+            node['seq'] += 1
+            seq = node['seq']
+
+        try:
+            entries = scan_dir(path)
+        except OSError:
+            with self.lock:
+                if tree.nodes.get(path) is node:
+                    self.drop_node(tree, path)
+            return None
+
+        with self.lock:
+            # only keep it if the node is still there and nobody started a newer read meanwhile
+            if tree.nodes.get(path) is node and node['seq'] == seq:
+                node['entries'] = entries
+                node['scanned'] = time.monotonic()
+
+        return entries
+
+    def drop_node(self, tree, path):
+        prefix = path + os.sep
+
+        for node_path in [p for p in tree.nodes if p == path or p.startswith(prefix)]:
+            node = tree.nodes.pop(node_path)
+
+            if node['wd'] is not None and self.wds.pop(node['wd'], None) is not None:
+                self.libc.inotify_rm_watch(self.fd, node['wd'])
+
+    def find_tree(self, path):
+        best = None
+
+        for root_path, tree in self.trees.items():
+            if path == root_path or path.startswith(root_path + os.sep):
+                if best is None or len(root_path) > len(best.root_path):
+                    best = tree
+
+        return best
+
+    def get_entries(self, path):
+        """
+        Returns a directory listing, from memory if it is up to date
+
+        Args:
+            path (string): the directory to list
+
+        Returns:
+            dict: file name -> {'is_dir', 'is_link', 'size', 'mtime'}
+
+        Raises:
+            OSError: the directory doesn't exist or can't be read
+        """
+        path = os.path.normpath(path)
+
+        with self.lock:
+            tree = self.find_tree(path)
+
+            if tree is not None:
+                node = tree.nodes.get(path)
+                stale = (node is None or node['dirty'] or
+                         (node['wd'] is None and time.monotonic() - node['scanned'] > RESCAN_INTERVAL))
+
+                if not stale:
+                    return dict(node['entries'])
+
+        if tree is not None:
+            entries = self.refresh_node(tree, path)
+
+            if entries is not None:
+                return dict(entries)
+
+        # not watched, or it vanished while we looked - let the disk answer (and raise)
+        return scan_dir(path)
+
+    def stat(self, path):
+        """
+        Returns what we know about one file or directory
+
+        Args:
+            path (string): the path to look up
+
+        Returns:
+            dict: {'is_dir', 'is_link', 'size', 'mtime'}, or None if it doesn't exist
+        """
+        path = os.path.normpath(path)
+        parent = os.path.dirname(path)
+
+        with self.lock:
+            watched = self.find_tree(parent) is not None
+
+        # no point listing a whole directory we don't keep just to look at one file in it
+        if not watched:
+            return stat_path(path)
+
+        try:
+            return self.get_entries(parent).get(os.path.basename(path))
+        except OSError:
+            return None
+
+    def walk(self, path):
+        """
+        Like os.walk, but served from memory where we can
+
+        Yields:
+            tuple: (directory path, entries dict) for each directory, parents first
+        """
+        stack = [os.path.normpath(path)]
+
+        while stack:
+            dir_path = stack.pop()
+
+            try:
+                entries = self.get_entries(dir_path)
+            except OSError:
+                continue
+
+            yield dir_path, entries
+
+            stack.extend(os.path.join(dir_path, name) for name, entry in entries.items()
+                         if entry['is_dir'] and not entry['is_link'])
+
+    def get_dir_size(self, path):
+        total = 0
+
+        for dir_path, entries in self.walk(path):
+            total += sum(entry['size'] for entry in entries.values() if not entry['is_dir'])
+
+        return total
+
+    def find_dirs(self, root_path, name):
+        """
+        Finds every directory with a given name under a fully watched tree
+
+        Args:
+            root_path (string): the watched path
+            name (string): the directory name to look for
+
+        Returns:
+            list: matching directory paths, or None if the tree isn't fully watched
+                  (callers should look on disk themselves)
+        """
+        root_path = os.path.normpath(root_path)
+
+        with self.lock:
+            tree = self.trees.get(root_path)
+
+            if tree is None or not tree.fully_watched():
+                return None
+
+            return [path for path in tree.nodes if os.path.basename(path) == name]
+
+    def read_events(self):
+        while True:
+            try:
+                readable, _, _ = select.select([self.fd], [], [], 1)
+            except (OSError, ValueError):
+                break
+
+            if not readable:
+                continue
+
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError:
+                logger.exception("Unable to read inotify events. Traceback:")
+                break
+
+            with self.lock:
+                self.handle_events(data)
+
+        logger.warning("inotify reader stopped")
+
+    def handle_events(self, data):
+        offset = 0
+        repopulate = []
+
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # we lost events, so we can't trust anything we have
+                logger.warning("inotify queue overflowed, rereading watched directories")
+                for tree in self.trees.values():
+                    for node in tree.nodes.values():
+                        node['dirty'] = True
+                    repopulate.append((tree, tree.root_path))
+                continue
+
+            if mask & IN_IGNORED:
+                watched = self.wds.pop(wd, None)
+
+                # the kernel dropped the watch - read the directory from disk until refresh_node() watches it again
+                if watched is not None:
+                    tree, dir_path = watched
+                    node = tree.nodes.get(dir_path)
+
+                    if node is not None and node['wd'] == wd:
+                        node['wd'] = None
+                        node['dirty'] = True
+                continue
+
+            watched = self.wds.get(wd)
+
+            if watched is None:
+                continue
+
+            tree, dir_path = watched
+            node = tree.nodes.get(dir_path)
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self.drop_node(tree, dir_path)
+                continue
+
+            if node is not None:
+                node['dirty'] = True
+
+            if mask & IN_ISDIR and name:
+                child_path = os.path.join(dir_path, os.fsdecode(name))
+
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    repopulate.append((tree, child_path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.drop_node(tree, child_path)
+
+        for tree, path in repopulate:
+            self.queue_populate(tree, path)
+
+
+fs_watcher = FsWatcher()
@@ -15,6 +15,8 @@ from app.classes.web_sessions import web_session
 from app.classes.multiserv import multi
 from app.classes.ftp import ftp_svr_object
 from app.classes.backupmgr import backupmgr
+from app.classes.command_queue import command_queue
+from app.classes.lazy_context import LazyContext
 
 logger = logging.getLogger(__name__)
 
@@ -25,20 +27,36 @@ class AdminHandler(BaseHandler):
         self.console = console
         self.session = web_session(self.current_user)
 
+    def build_context(self, user_data):
+        """
+        Returns the context every admin page starts from - anything a page might not use is only worked out when read
+
+        Args:
+            user_data (mapping): the user's permissions, from get_perms_for_user()
+
+        Returns:
+            LazyContext: user_data, version_data, managed_server, servers_defined, servers_running and mc_servers_data
+        """
+        context = LazyContext(user_data=user_data)
+
+        context.lazy('version_data', helper.get_version)
+        context.lazy('managed_server', lambda: self.session.get_data(self.current_user, 'managed_server'))
+
+        # the three server keys come from the same snapshot (as of the last stats run or server state change)
+        context.lazy('fleet_snapshot', multi.get_fleet_snapshot)
+        context.lazy('servers_defined', lambda: context['fleet_snapshot'].servers_defined)
+        context.lazy('servers_running', lambda: context['fleet_snapshot'].servers_running)
+        context.lazy('mc_servers_data', lambda: context['fleet_snapshot'].mc_servers_data)
+
+        return context
+
     @tornado.web.authenticated
     def get(self, page):
 
         name = tornado.escape.json_decode(self.current_user)
         user_data = get_perms_for_user(name)
 
-        context = {
-            'user_data': user_data,
-            'version_data': helper.get_version(),
-            'servers_defined': multi.list_servers(),
-            'managed_server': self.session.get_data(self.current_user, 'managed_server'),
-            'servers_running': multi.list_running_servers(),
-            'mc_servers_data': multi.get_stats_for_servers()
-        }
+        context = self.build_context(user_data)
 
         if page == 'unauthorized':
             template = "admin/denied.html"
@@ -55,19 +73,12 @@ class AdminHandler(BaseHandler):
                 data=context
             )
             # reload web server
-            Remote.insert({
-                Remote.command: 'restart_web_server',
-                Remote.server_id: 1,  # this doesn't really matter as we are not tying to a server
-                Remote.command_source: 'local'
-            }).execute()
+            # the server id doesn't really matter as we are not tying to a server
+            command_queue.put('restart_web_server', 1, 'local')
 
         elif page == 'reload_mc_settings':
-            Remote.insert({
-                Remote.command: 'reload_mc_settings',
-                Remote.server_id: 1, # this doesn't really matter as we are not tying to a server
-                Remote.command_source: 'local'
-
-            }).execute()
+            # the server id doesn't really matter as we are not tying to a server
+            command_queue.put('reload_mc_settings', 1, 'local')
 
             self.redirect("/admin/config")
 
@@ -87,7 +98,7 @@ class AdminHandler(BaseHandler):
 
             context['server_id'] = bleach.clean(self.get_argument('id', ''))
 
-            mc_data = MC_settings.get_by_id(context['server_id'])
+            mc_data = multi.get_server_data(context['server_id'])
 
             context['server_name'] = mc_data.server_name
 
@@ -98,7 +109,7 @@ class AdminHandler(BaseHandler):
                 self.redirect('/admin/unauthorized')
                 
             server_id = bleach.clean(self.get_argument('id', ''))
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             
             template = "admin/backups.html"
 
@@ -229,7 +240,7 @@ class AdminHandler(BaseHandler):
 
             template = "admin/server_config.html"
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
 
             page_data = {}
             context['saved'] = saved
@@ -256,7 +267,7 @@ class AdminHandler(BaseHandler):
             template = "admin/server_control.html"
             logfile = helper.get_crafty_log_file()
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
 
             srv_obj = multi.get_server_obj(server_id)
             context['server_running'] = srv_obj.check_running()
@@ -278,44 +289,24 @@ class AdminHandler(BaseHandler):
             any_serv_obj.reload_settings()
 
             if command == "server_stop":
-                Remote.insert({
-                    Remote.command: 'stop_mc_server',
-                    Remote.server_id: id,
-                    Remote.command_source: "localhost"
-                }).execute()
+                command_queue.put('stop_mc_server', id, "localhost")
                 next_page = "/admin/virtual_console?id={}".format(id)
 
             elif command == "server_start":
-                Remote.insert({
-                    Remote.command: 'start_mc_server',
-                    Remote.server_id: id,
-                    Remote.command_source: "localhost"
-                }).execute()
+                command_queue.put('start_mc_server', id, "localhost")
                 next_page = "/admin/virtual_console?id={}".format(id)
 
             elif command == "server_restart":
-                Remote.insert({
-                    Remote.command: 'restart_mc_server',
-                    Remote.server_id: id,
-                    Remote.command_source: "localhost"
-                }).execute()
+                command_queue.put('restart_mc_server', id, "localhost")
                 next_page = "/admin/virtual_console?id={}".format(id)
 
             elif command == "ftp_server_start":
-                Remote.insert({
-                    Remote.command: 'start_ftp',
-                    Remote.server_id: id,
-                    Remote.command_source: 'localhost'
-                }).execute()
+                command_queue.put('start_ftp', id, 'localhost')
                 time.sleep(2)
                 next_page = "/admin/files?id={}".format(id)
 
             elif command == 'ftp_server_stop':
-                Remote.insert({
-                    Remote.command: 'stop_ftp',
-                    Remote.server_id: id,
-                    Remote.command_source: 'localhost'
-                }).execute()
+                command_queue.put('stop_ftp', id, 'localhost')
                 time.sleep(2)
                 next_page = "/admin/files?id={}".format(id)
 
@@ -330,29 +321,17 @@ class AdminHandler(BaseHandler):
                 next_page = '/admin/backups'
 
             elif command == 'update_jar':
-                Remote.insert({
-                    Remote.command: 'update_server_jar',
-                    Remote.server_id: id,
-                    Remote.command_source: 'localhost'
-                }).execute()
+                command_queue.put('update_server_jar', id, 'localhost')
                 time.sleep(2)
                 next_page = "/admin/server_control?id={}".format(id)
 
             elif command == 'revert_jar':
-                Remote.insert({
-                    Remote.command: 'revert_server_jar',
-                    Remote.server_id: id,
-                    Remote.command_source: 'localhost'
-                }).execute()
+                command_queue.put('revert_server_jar', id, 'localhost')
                 time.sleep(2)
                 next_page = "/admin/server_control?id={}".format(id)
 
             elif command == 'destroy_world':
-                Remote.insert({
-                    Remote.command: 'destroy_world',
-                    Remote.server_id: id,
-                    Remote.command_source: "localhost"
-                }).execute()
+                command_queue.put('destroy_world', id, "localhost")
                 next_page = "/admin/virtual_console?id={}".format(id)
 
             self.redirect(next_page)
@@ -362,7 +341,7 @@ class AdminHandler(BaseHandler):
                 self.redirect('/admin/unauthorized')
 
             server_id = bleach.clean(self.get_argument('id', None))
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
 
             context['server_name'] = mc_data.server_name
             context['server_id'] = server_id
@@ -435,15 +414,7 @@ class AdminHandler(BaseHandler):
         name = tornado.escape.json_decode(self.current_user)
         user_data = get_perms_for_user(name)
 
-        # server_data = self.get_server_data()
-        context = {
-            'user_data': user_data,
-            'version_data': helper.get_version(),
-            'servers_defined': multi.list_servers(),
-            'managed_server': self.session.get_data(self.current_user, 'managed_server'),
-            'servers_running': multi.list_running_servers(),
-            'mc_servers_data': multi.get_stats_for_servers()
-        }
+        context = self.build_context(user_data)
 
         if page == 'change_password':
             entered_password = bleach.clean(self.get_argument('password'))
@@ -522,7 +493,7 @@ class AdminHandler(BaseHandler):
                     }).where(MC_settings.id == 1)
 
                     q.execute()
-                    self.mcserver.reload_settings()
+                    multi.reload_server_settings(1)
 
                 # Restructure things a bit and add Java path check
                 elif not server_path_exists:
@@ -552,12 +523,16 @@ class AdminHandler(BaseHandler):
             elif config_type == 'crafty_settings':
                 interval = bleach.clean(self.get_argument('historical_interval'))
                 max_age = bleach.clean(self.get_argument('history_max_age'))
+                max_age_5min = max(int(float(self.get_argument('history_5min_max_age', 30))), 1)
+                max_age_hourly = max(int(float(self.get_argument('history_hourly_max_age', 365))), 1)
                 lang = bleach.clean(self.get_argument('language'))
                 web_port = int(float(self.get_argument('port_number')))
 
                 q = Crafty_settings.update({
                     Crafty_settings.history_interval: interval,
                     Crafty_settings.history_max_age: max_age,
+                    Crafty_settings.history_5min_max_age: max_age_5min,
+                    Crafty_settings.history_hourly_max_age: max_age_hourly,
                     Crafty_settings.language: lang,
                 }).where(Crafty_settings.id == 1).execute()
 
@@ -607,13 +582,14 @@ class AdminHandler(BaseHandler):
                     MC_settings.auto_start_delay: int(float(self.get_argument('auto_start_delay'))),
                     MC_settings.auto_start_priority: int(float(self.get_argument('auto_start_priority'))),
                     MC_settings.crash_detection: int(float(self.get_argument('crash_detection'))),
+                    MC_settings.stop_timeout: max(int(float(self.get_argument('stop_timeout', 60))), 1),
                     MC_settings.server_port: int(float(self.get_argument('server_port'))),
                     MC_settings.server_ip: bleach.clean(self.get_argument('server_ip')),
                     MC_settings.jar_url: bleach.clean(self.get_argument('jar_url')),
                 }).where(MC_settings.id == server_id).execute()
 
-                srv_obj = multi.get_first_server_object()
-                srv_obj.reload_settings()
+                # drop the cached settings and hand the new ones to this server's object
+                multi.reload_server_settings(server_id)
 
                 self.redirect("/admin/dashboard")
 
@@ -644,7 +620,7 @@ class AdminHandler(BaseHandler):
 
             context['listing'] = helper.scan_dirs_in_path(context['pwd'])
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
@@ -795,7 +771,7 @@ class AdminHandler(BaseHandler):
 
             path = Path(pwd)
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
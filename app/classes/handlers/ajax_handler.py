@@ -2,6 +2,7 @@ import tornado.web
 import tornado.escape
 import schedule
 import bleach
+import datetime
 
 from app.classes.console import console
 from app.classes.models import *
@@ -10,6 +11,8 @@ from app.classes.web_sessions import web_session
 from app.classes.multiserv import multi
 from app.classes.ftp import ftp_svr_object
 from app.classes.backupmgr import backupmgr
+from app.classes.historymgr import historymgr, DEFAULT_MAX_POINTS
+from app.classes.timeseries import SERIES_SECONDS
 from zipfile import ZipFile
 import shutil
 
@@ -32,29 +35,53 @@ class AjaxHandler(BaseHandler):
                 logger.warning("Server ID not found in server_log ajax call")
                 return False
 
-            server_path = multi.get_server_root_path(server_id)
+            try:
+                since = int(self.get_argument('since', 0))
+            except ValueError:
+                since = 0
 
-            server_log = os.path.join(server_path, 'logs', 'latest.log')
-            data = helper.tail_file(server_log, 40)
+            srv_obj = multi.get_server_obj(server_id)
 
-            for d in data:
-                self.write(d.encode("utf-8"))
+            # all open consoles read from the same in-memory buffer, only the lines they haven't seen
+            self.write(json.dumps(srv_obj.get_console_lines(since)))
 
         elif page == 'history':
             server_id = bleach.clean(self.get_argument("server_id",''))
 
-            db_data = History.select().where(History.server_id == server_id)
-            return_data = []
-            for d in db_data:
-                row_data = {
-                    'time': d.time.strftime("%m/%d/%Y %H:%M:%S"),
-                    'cpu': d.cpu,
-                    'mem': d.memory,
-                    'players': d.players
-                }
-                return_data.append(row_data)
+            # from / to are unix timestamps, both optional
+            try:
+                start = self.get_argument('from', None)
+                end = self.get_argument('to', None)
+                start = datetime.datetime.fromtimestamp(float(start)) if start else None
+                end = datetime.datetime.fromtimestamp(float(end)) if end else None
+                max_points = int(self.get_argument('max_points', DEFAULT_MAX_POINTS))
+                server_id = int(server_id)
+            except (ValueError, OverflowError, OSError):
+                self.set_status(400)
+                self.write(json.dumps({'error': 'Invalid history range'}))
+                return
+
+            now = datetime.datetime.now()
+            srv_obj = multi.get_server_obj(server_id)
 
-            self.write(json.dumps(return_data))
+            # the last hour is kept in memory at one second resolution - no need to ask the database
+            if (srv_obj is not None and start is not None and
+                    (end is None or abs((now - end).total_seconds()) < 60) and
+                    (now - start).total_seconds() <= SERIES_SECONDS):
+                seconds = int((now - start).total_seconds())
+                data = srv_obj.timeseries.get_window(seconds, max_points)
+
+                # nothing is sampled while a server is stopped, and the buffer starts empty after a restart -
+                # if it isn't being filled or doesn't reach back to the start of the range, the database has more
+                if data['time'] and srv_obj.check_running():
+                    first = datetime.datetime.strptime(data['time'][0], "%Y-%m-%d %H:%M:%S")
+
+                    if first <= start + datetime.timedelta(seconds=data['bucket_seconds']):
+                        self.write(json.dumps(data))
+                        return
+
+            # aggregated by the database, so this is the same size however much history we keep
+            self.write(json.dumps(historymgr.get_history(server_id, start, end, max_points)))
 
         elif page == 'update_check':
 
@@ -117,9 +144,11 @@ class AjaxHandler(BaseHandler):
             name = tornado.escape.json_decode(self.current_user)
             user_data = get_perms_for_user(name)
 
+            snapshot = multi.get_fleet_snapshot()
+
             context = {
-                'servers_running': multi.list_running_servers(),
-                'servers_defined': multi.list_servers(),
+                'servers_running': snapshot.servers_running,
+                'servers_defined': snapshot.servers_defined,
             }                 
                     
             self.render(
@@ -134,7 +163,7 @@ class AjaxHandler(BaseHandler):
 
             context = {
                 'user_data': user_data,
-                'mc_servers_data': multi.get_stats_for_servers()
+                'mc_servers_data': multi.get_fleet_snapshot().mc_servers_data
             }     
 
             server_id = bleach.clean(self.get_argument('id'))
@@ -160,7 +189,7 @@ class AjaxHandler(BaseHandler):
 
             context = {
                 'user_data': user_data,
-                'mc_servers_data': multi.get_stats_for_servers()
+                'mc_servers_data': multi.get_fleet_snapshot().mc_servers_data
             }     
 
             server_id = bleach.clean(self.get_argument('id', 1))
@@ -183,7 +212,7 @@ class AjaxHandler(BaseHandler):
             file_path = bleach.clean(self.get_argument('file_name'))
             server_id = bleach.clean(self.get_argument('server_id'))
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
@@ -260,7 +289,7 @@ class AjaxHandler(BaseHandler):
             search_string = bleach.clean(self.get_body_argument('search', default=None, strip=True))
             server_id = bleach.clean(self.get_body_argument('id', default=None, strip=True))
 
-            data = MC_settings.get_by_id(server_id)
+            data = multi.get_server_data(server_id)
             logfile = os.path.join(data.server_path, 'logs', 'latest.log')
             data = helper.search_file(logfile, search_string)
             if data:
@@ -292,6 +321,7 @@ class AjaxHandler(BaseHandler):
                     Users.api_token: api_token,
                     Users.password: helper.encode_pass(new_pass)
                 }).execute()
+                permission_cache.bump()
 
                 self.write(new_pass)
 
@@ -311,6 +341,7 @@ class AjaxHandler(BaseHandler):
                     Users.update({
                         Users.role: role
                     }).where(Users.username == username).execute()
+                    permission_cache.bump()
 
                     self.write('updated')
 
@@ -343,6 +374,7 @@ class AjaxHandler(BaseHandler):
             else:
                 if username:
                     Users.delete().where(Users.username == username).execute()
+                    permission_cache.bump()
                     self.write("{} deleted".format(username))
 
         elif page == 'add_role':
@@ -366,6 +398,7 @@ class AjaxHandler(BaseHandler):
                     Roles.files: False,
                     Roles.api_access: False,
                 }).execute()
+                permission_cache.bump()
 
                 self.write("{}".format(new_rolename))
 
@@ -398,6 +431,7 @@ class AjaxHandler(BaseHandler):
                     Roles.files: new_files,
                     Roles.api_access: new_api_access,
                 }).where(Roles.name == rolename).execute()
+                permission_cache.bump()
                     
                 self.write("{} edited".format(rolename))
 
@@ -414,6 +448,7 @@ class AjaxHandler(BaseHandler):
             else:
                 if rolename:
                     Roles.delete().where(Roles.name == rolename).execute()
+                    permission_cache.bump()
                     self.write("{} deleted".format(rolename))
 
         elif page == 'save_file':
@@ -421,7 +456,7 @@ class AjaxHandler(BaseHandler):
             file_path = bleach.clean(self.get_argument("file_path"))
             server_id = bleach.clean(self.get_argument("server_id"))
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
@@ -448,7 +483,7 @@ class AjaxHandler(BaseHandler):
             file_path = bleach.clean(self.get_argument("file_name"))
             server_id = bleach.clean(self.get_argument("server_id"))
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
@@ -479,7 +514,7 @@ class AjaxHandler(BaseHandler):
             pwd = bleach.clean(self.get_argument("pwd"))
             name = bleach.clean(self.get_argument("name"))
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
@@ -511,7 +546,7 @@ class AjaxHandler(BaseHandler):
             server_id = bleach.clean(self.get_argument("server_id"))
             pwd = bleach.clean(self.get_argument("pwd"))
 
-            mc_data = MC_settings.get_by_id(server_id)
+            mc_data = multi.get_server_data(server_id)
             mc_settings = model_to_dict(mc_data)
 
             mc_settings['server_path'] = str(mc_settings['server_path']).replace("\\", '/')
@@ -0,0 +1,90 @@
+import json
+import bleach
+import logging
+import tornado.ioloop
+import tornado.escape
+import tornado.websocket
+
+from app.classes.models import check_role_permission
+from app.classes.multiserv import multi
+
+logger = logging.getLogger(__name__)
+
+
+class ConsoleWebSocketHandler(tornado.websocket.WebSocketHandler):
+
+    def initialize(self, mcserver):
+        self.mcserver = mcserver
+        self.srv_obj = None
+        self.ioloop = None
+        self.last_seq = 0
+
+    def get_current_user(self):
+        return self.get_secure_cookie("user", max_age_days=1)
+
+    def open(self):
+        if not self.current_user:
+            logger.warning("Unauthenticated websocket console connection from %s refused", self.request.remote_ip)
+            self.close(4001, "Not logged in")
+            return
+
+        username = tornado.escape.json_decode(self.current_user)
+
+        if not check_role_permission(username, 'svr_console'):
+            self.close(4003, "Access denied")
+            return
+
+        server_id = bleach.clean(self.get_argument('id', ''))
+        self.srv_obj = multi.get_server_obj(server_id)
+
+        if self.srv_obj is None:
+            self.close(4004, "Unknown server")
+            return
+
+        try:
+            since = int(self.get_argument('since', 0))
+        except ValueError:
+            since = 0
+
+        self.ioloop = tornado.ioloop.IOLoop.current()
+
+        # subscribe before we read the backlog so no line can slip between the two,
+        # anything we get twice is dropped by its sequence number in _push_line
+        self.srv_obj.console_buffer.add_listener(self.on_console_line)
+
+        backlog = self.srv_obj.get_console_lines(since)
+        self.last_seq = backlog['seq']
+        self.write_message(json.dumps(backlog))
+
+        logger.info("User %s opened a websocket console for server %s", username, server_id)
+
+    def on_console_line(self, seq, line):
+        # called from the console reader thread - hand the line over to the ioloop
+        self.ioloop.add_callback(self._push_line, seq, line)
+
+    def _push_line(self, seq, line):
+        if seq <= self.last_seq:
+            return
+
+        self.last_seq = seq
+
+        try:
+            self.write_message(json.dumps({'seq': seq, 'lines': [line], 'reset': False}))
+        except tornado.websocket.WebSocketClosedError:
+            self._unsubscribe()
+
+    def on_message(self, message):
+        command = bleach.clean(message.strip())
+
+        if not command or self.srv_obj is None:
+            return
+
+        if self.srv_obj.check_running():
+            self.srv_obj.send_command(command)
+
+    def on_close(self):
+        self._unsubscribe()
+
+    def _unsubscribe(self):
+        if self.srv_obj is not None:
+            self.srv_obj.console_buffer.remove_listener(self.on_console_line)
@@ -13,13 +13,13 @@ import zipfile
 import logging
 import requests
 import schedule
-import configparser
 
 from datetime import datetime
 from OpenSSL import crypto, SSL
 from socket import gethostname
 
 from app.classes.console import console
+from app.classes.fs_watcher import fs_watcher
 from argon2 import PasswordHasher
 
 logger = logging.getLogger(__name__)
@@ -45,9 +45,13 @@ class helpers:
         
         self.methods = ["GET", "POST", "PUT", "DELETE"]
 
+        # version.json only changes with an update, which means a restart - so we read it once
+        self.version_data = None
+
     def redefine_paths(self, config_dir, db_dir):
         self.dbpath = os.path.join(db_dir, "crafty.sqlite")
         self.config_dir = config_dir
+        self.version_data = None
 
     def is_fresh_install(self):
 
@@ -411,13 +415,14 @@ class helpers:
     def scan_dirs_in_path(self, root_path):
         structure = []
 
-        files = os.listdir(root_path)
+        # served from memory if this is inside a watched server directory
+        files = fs_watcher.get_entries(root_path)
         root_path = root_path.replace('\\', '/')
-        for f in files:
-            if os.path.isdir(os.path.join(root_path, f)):
+        for f, entry in files.items():
+            if entry['is_dir']:
                 structure.append({'type': 'dir', 'name': "{}/{}".format(root_path, f)})
             else:
-                size = self.human_readable_file_size(os.path.getsize(os.path.join(root_path, f)))
+                size = self.human_readable_file_size(entry['size'])
                 structure.append({
                     'type': 'file',
                     'name': "{}/{}".format(root_path, f),
@@ -490,9 +495,12 @@ class helpers:
             pass
 
     def get_version(self):
-        with open(os.path.join(self.config_dir, 'version.json'), 'r') as f:
-            version_data = json.load(f)
-            return version_data
+        if self.version_data is None:
+            with open(os.path.join(self.config_dir, 'version.json'), 'r') as f:
+                self.version_data = json.load(f)
+
+        # a copy, so no caller can change the one we keep
+        return dict(self.version_data)
 
     def copy_file(self, source, dest):
 
@@ -518,20 +526,6 @@ class helpers:
 
         return True
 
-    def load_server_properties(self, mc_server_obj, properties_name="server.properties"):
-        # get server path
-        server_path = mc_server_obj.server_path
-        # Create config path
-        config_path = os.path.join(server_path, properties_name)
-
-        # make sure that the file exists
-        if os.path.isfile(config_path):
-            config = configparser.ConfigParser()
-            config.read(config_path)
-            return config
-        else:
-            return None
-
     def check_writeable(self, path):
         filename = os.path.join(path, "tempfile.txt")
         try:
@@ -0,0 +1,222 @@
+import logging
+import datetime
+
+from app.classes.models import database, History, History_5min, History_Hourly, Crafty_settings
+
+logger = logging.getLogger(__name__)
+
+# how often the rollup job runs, in minutes
+ROLLUP_INTERVAL = 5
+
+# SQLite stores our datetimes as local time text - this turns one into the start of its bucket, in the same format
+BUCKET_SQL = "datetime((CAST(strftime('%s', {column}) AS INTEGER) / {seconds}) * {seconds}, 'unixepoch')"
+
+# raw samples -> 5 minute buckets
+ROLLUP_RAW_SQL = """
+    INSERT INTO {target} (server_id, time, samples,
+                          cpu_min, cpu_avg, cpu_max,
+                          memory_min, memory_avg, memory_max,
+                          players_min, players_avg, players_max)
+    SELECT server_id, {bucket} AS bucket, COUNT(*),
+           MIN(cpu), AVG(cpu), MAX(cpu),
+           MIN(memory), AVG(memory), MAX(memory),
+           MIN(players), AVG(players), MAX(players)
+    FROM {source}
+    WHERE time >= ?
+    GROUP BY server_id, bucket
+    ON CONFLICT(server_id, time) DO UPDATE SET
+        samples = excluded.samples,
+        cpu_min = excluded.cpu_min, cpu_avg = excluded.cpu_avg, cpu_max = excluded.cpu_max,
+        memory_min = excluded.memory_min, memory_avg = excluded.memory_avg, memory_max = excluded.memory_max,
+        players_min = excluded.players_min, players_avg = excluded.players_avg, players_max = excluded.players_max
+"""
+
+# one rollup tier -> a coarser one, averages are weighted by how many samples went into each bucket
+ROLLUP_TIER_SQL = """
+    INSERT INTO {target} (server_id, time, samples,
+                          cpu_min, cpu_avg, cpu_max,
+                          memory_min, memory_avg, memory_max,
+                          players_min, players_avg, players_max)
+    SELECT server_id, {bucket} AS bucket, SUM(samples),
+           MIN(cpu_min), SUM(cpu_avg * samples) / SUM(samples), MAX(cpu_max),
+           MIN(memory_min), SUM(memory_avg * samples) / SUM(samples), MAX(memory_max),
+           MIN(players_min), SUM(players_avg * samples) / SUM(samples), MAX(players_max)
+    FROM {source}
+    WHERE time >= ?
+    GROUP BY server_id, bucket
+    ON CONFLICT(server_id, time) DO UPDATE SET
+        samples = excluded.samples,
+        cpu_min = excluded.cpu_min, cpu_avg = excluded.cpu_avg, cpu_max = excluded.cpu_max,
+        memory_min = excluded.memory_min, memory_avg = excluded.memory_avg, memory_max = excluded.memory_max,
+        players_min = excluded.players_min, players_avg = excluded.players_avg, players_max = excluded.players_max
+"""
+
+# (model, bucket size in seconds, source model, sql)
+TIERS = [
+    (History_5min, 300, History, ROLLUP_RAW_SQL),
+    (History_Hourly, 3600, History_5min, ROLLUP_TIER_SQL),
+]
+
+# chart queries - averages cpu and memory, and takes the peak player count, for each bucket
+QUERY_RAW_SQL = """
+    SELECT {bucket} AS bucket, AVG(cpu), AVG(memory), MAX(players)
+    FROM {source}
+    WHERE server_id = ? AND time >= ? AND time < ?
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+QUERY_TIER_SQL = """
+    SELECT {bucket} AS bucket, SUM(cpu_avg * samples) / SUM(samples), SUM(memory_avg * samples) / SUM(samples),
+           MAX(players_max)
+    FROM {source}
+    WHERE server_id = ? AND time >= ? AND time < ?
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+# limits on how many points a chart can ask for
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS_LIMIT = 5000
+
+
+class HistoryMGR():
+
+    def rollup(self, target, seconds, source, sql):
+        """
+        Rolls one table up into the buckets of another
+
+        We start from the newest bucket we already have (it may have been partial last time),
+        so every run only reads the rows that came in since the last one
+
+        Args:
+            target (Model): the rollup table to fill
+            seconds (int): bucket size
+            source (Model): the table to read from
+            sql (string): ROLLUP_RAW_SQL or ROLLUP_TIER_SQL
+        """
+        newest = target.select(target.time).order_by(target.time.desc()).limit(1).first()
+
+        if newest is not None:
+            since = newest.time.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            since = "0000-00-00 00:00:00"
+
+        query = sql.format(target=target._meta.table_name,
+                           source=source._meta.table_name,
+                           bucket=BUCKET_SQL.format(column='time', seconds=seconds))
+
+        database.execute_sql(query, (since,))
+
+    def prune(self):
+        settings = Crafty_settings.get_by_id(1)
+        now = datetime.datetime.now()
+
+        retention = [
+            (History, settings.history_max_age),
+            (History_5min, settings.history_5min_max_age),
+            (History_Hourly, settings.history_hourly_max_age),
+        ]
+
+        for model, max_days in retention:
+            max_age = now - datetime.timedelta(days=int(max_days))
+            deleted = model.delete().where(model.time < max_age).execute()
+
+            if deleted:
+                logger.debug("Deleted %s %s rows older than %s days", deleted, model._meta.table_name, max_days)
+
+    def do_rollups(self):
+        """
+        Rolls raw history up into 5 minute and hourly min/avg/max buckets, then drops anything past its retention
+
+        Each tier is rolled up before anything is pruned, so a sample is always in a coarser tier before it goes
+        """
+        try:
+            with database.atomic():
+                for target, seconds, source, sql in TIERS:
+                    self.rollup(target, seconds, source, sql)
+
+                self.prune()
+        except Exception:
+            logger.exception("Unable to roll up server history. Traceback:")
+
+    def get_history(self, server_id, start=None, end=None, max_points=DEFAULT_MAX_POINTS):
+        """
+        Returns a server's history between two times, averaged down to at most max_points buckets
+
+        The aggregation is done by SQLite, from the coarsest table that is still fine enough for the
+        bucket size and still keeps data back to start - so a year of history costs about the same as an hour
+
+        Args:
+            server_id (int): the server
+            start (datetime): oldest time to include, defaults to as far back as we keep raw samples
+            end (datetime): newest time to include, defaults to now
+            max_points (int): how many points the caller wants, at most
+
+        Returns:
+            dict: columnar arrays - time (local 'YYYY-MM-DD HH:MM:SS' bucket starts), cpu, mem, players -
+                  plus the bucket size in seconds and which table answered
+        """
+        settings = Crafty_settings.get_by_id(1)
+        now = datetime.datetime.now()
+
+        if end is None:
+            end = now
+
+        if start is None:
+            start = now - datetime.timedelta(days=int(settings.history_max_age))
+
+        max_points = min(max(int(max_points), 1), MAX_POINTS_LIMIT)
+        span = max((end - start).total_seconds(), 1)
+        bucket_seconds = max(int(-(-span // max_points)), 1)
+
+        # finest first: (model, resolution in seconds, days kept, sql)
+        sources = [
+            (History, 1, settings.history_max_age, QUERY_RAW_SQL),
+            (History_5min, 300, settings.history_5min_max_age, QUERY_TIER_SQL),
+            (History_Hourly, 3600, settings.history_hourly_max_age, QUERY_TIER_SQL),
+        ]
+
+        # the coarsest table that is fine enough - fewer rows to read
+        choice = 0
+        for index, source in enumerate(sources):
+            if source[1] <= bucket_seconds:
+                choice = index
+
+        # but if it has already pruned the start of the range, go coarser
+        while choice < len(sources) - 1 and now - datetime.timedelta(days=int(sources[choice][2])) > start:
+            choice += 1
+
+        model, resolution, max_days, sql = sources[choice]
+        bucket_seconds = max(bucket_seconds, resolution)
+
+        query = sql.format(source=model._meta.table_name,
+                           bucket=BUCKET_SQL.format(column='time', seconds=bucket_seconds))
+
+        cursor = database.execute_sql(query, (int(server_id),
+                                              start.strftime("%Y-%m-%d %H:%M:%S"),
+                                              end.strftime("%Y-%m-%d %H:%M:%S")))
+
+        data = {
+            'time': [],
+            'cpu': [],
+            'mem': [],
+            'players': [],
+            'bucket_seconds': bucket_seconds,
+            'source': model._meta.table_name
+        }
+
+        for bucket_time, cpu, mem, players in cursor.fetchall():
+            data['time'].append(bucket_time)
+            data['cpu'].append(round(cpu or 0, 2))
+            data['mem'].append(round(mem or 0, 2))
+            data['players'].append(players or 0)
+
+        return data
+
+    def delete_server_history(self, server_id):
+        for model in (History, History_5min, History_Hourly):
+            model.delete().where(model.server_id == int(server_id)).execute()
+
+
+historymgr = HistoryMGR()
@@ -30,6 +30,7 @@ from app.classes.handlers.admin_handler import AdminHandler
 from app.classes.handlers.ajax_handler import AjaxHandler
 from app.classes.handlers.setup_handler import SetupHandler
 from app.classes.handlers.download_handler import DownloadHandler
+from app.classes.handlers.websocket_handler import ConsoleWebSocketHandler
 
 import app.classes.api as api_routes
 
@@ -120,6 +121,7 @@ class webserver():
             (r'/admin/(.*)', AdminHandler, dict(mcserver=self.mc_server)),
             (r'/ajax/(.*)', AjaxHandler, dict(mcserver=self.mc_server)),
             (r'/setup/(.*)', SetupHandler, dict(mcserver=self.mc_server)),
+            (r'/ws/console', ConsoleWebSocketHandler, dict(mcserver=self.mc_server)),
             (r'/static(.*)', tornado.web.StaticFileHandler, {"path": '/'}),
             (r'/images(.*)', tornado.web.StaticFileHandler, {"path": "/images"}),
 
@@ -131,12 +133,16 @@ class webserver():
             (r'/api/v1/server/send_command', api_routes.SendCommand, dict(mcserver=self.mc_server)),
             (r'/api/v1/server/get_logs', api_routes.GetMCLogs, dict(mcserver=self.mc_server)),
             (r'/api/v1/server/search_logs', api_routes.SearchMCLogs, dict(mcserver=self.mc_server)),
+            (r'/api/v1/server/startup_history', api_routes.GetStartupHistory, dict(mcserver=self.mc_server)),
             (r'/api/v1/server/force_backup', api_routes.ForceServerBackup, dict(mcserver=self.mc_server)),
             (r'/api/v1/server/start', api_routes.StartServer, dict(mcserver=self.mc_server)),
             (r'/api/v1/server/stop', api_routes.StopServer, dict(mcserver=self.mc_server)),
             (r'/api/v1/server/restart', api_routes.RestartServer, dict(mcserver=self.mc_server)),
             (r'/api/v1/list_servers', api_routes.ListServers, dict(mcserver=self.mc_server)),
 
+            # Prometheus scrape endpoint
+            (r'/metrics', api_routes.GetMetrics, dict(mcserver=self.mc_server)),
+
             # Crafty related
             (r'/api/v1/crafty/add_user', api_routes.CreateUser),
             (r'/api/v1/crafty/del_user', api_routes.DeleteUser),
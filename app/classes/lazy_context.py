@@ -0,0 +1,54 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LazyContext(dict):
+    """
+    A template context where some values are only worked out if something reads them
+
+    lazy() registers a function instead of a value. The first read of that key calls it and keeps the
+    result, so a page that never touches a key never pays for it, and one that reads it twice pays once.
+    Plain values are set as in any dict
+
+    Iterating (keys(), items(), json) only shows values that have been set or read so far
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # key -> function returning the value, until the key is first read
+        self.providers = {}
+
+    def lazy(self, key, provider):
+        """
+        Args:
+            key (string): the context key
+            provider (callable): called with no arguments the first time the key is read
+        """
+        self.pop(key, None)
+        self.providers[key] = provider
+
+    def __missing__(self, key):
+        provider = self.providers.pop(key, None)
+
+        if provider is None:
+            raise KeyError(key)
+
+        value = provider()
+        self[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        # a value set by hand wins over one we haven't worked out yet
+        self.providers.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self.providers
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
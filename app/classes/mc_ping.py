@@ -10,6 +10,9 @@ import logging.config
 
 logger = logging.getLogger(__name__)
 
+# seconds to wait on connect and on each read, so a server that accepts but never answers can't hang us
+PING_TIMEOUT = 3
+
 
 class Server:
     def __init__(self, data):
@@ -82,7 +85,7 @@ class Player:
 
 
 # For the rest of requests see wiki.vg/Protocol
-def ping(ip, port=25565):
+def ping(ip, port=25565, timeout=PING_TIMEOUT):
     def read_var_int():
         i = 0
         j = 0
@@ -99,10 +102,11 @@ def ping(ip, port=25565):
                 return i
 
     sock = socket.socket()
+    sock.settimeout(timeout)
     try:
         sock.connect((ip, port))
     except:
-        pass
+        sock.close()
         return False
 
     try:
@@ -133,5 +137,8 @@ def ping(ip, port=25565):
             data += chunk
         logger.debug("Server reports this data on ping: {}".format(data))
         return Server(json.loads(data))
+    except socket.timeout:
+        logger.debug("Timed out pinging %s:%s", ip, port)
+        return False
     finally:
         sock.close()
@@ -0,0 +1,86 @@
+import psutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# this doesn't change while we are running, no need to ask the OS every time
+CPU_COUNT = psutil.cpu_count() or 1
+TOTAL_MEMORY = psutil.virtual_memory().total
+
+
+class ProcessMetrics:
+    """
+    Samples CPU and memory for one process without blocking
+
+    Keeps a single psutil.Process handle for the life of the process, so CPU usage is the delta
+    since the previous sample instead of sleeping for an interval on every call
+    """
+
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+
+    def attach(self, pid):
+        with self.lock:
+            try:
+                self.process = psutil.Process(pid)
+
+                # the first call only sets the baseline and always returns 0.0
+                self.process.cpu_percent(interval=None)
+            except psutil.Error:
+                logger.warning("Unable to attach metrics to PID %s", pid)
+                self.process = None
+
+    def detach(self):
+        with self.lock:
+            self.process = None
+
+    def sample(self):
+        """
+        Returns:
+            dict: cpu_usage = percent of the whole host since the last sample, memory_bytes = rss,
+                  memory_percent = rss as a percent of host memory, or None if we aren't attached or the process is gone
+        """
+        with self.lock:
+            if self.process is None:
+                return None
+
+            try:
+                with self.process.oneshot():
+                    rss = self.process.memory_info().rss
+                    return {
+                        'cpu_usage': round(self.process.cpu_percent(interval=None) / CPU_COUNT, 2),
+                        'memory_bytes': rss,
+                        'memory_percent': round(rss / TOTAL_MEMORY * 100, 2)
+                    }
+            except psutil.Error:
+                self.process = None
+                return None
+
+
+class HostMetrics:
+    """
+    Samples host CPU usage without blocking
+
+    psutil keeps one global baseline for cpu_percent(interval=None), so everything that wants host CPU
+    reads it from here, otherwise callers would keep resetting each other's measurement window
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cpu_usage = 0.0
+
+        # set the baseline now, so the first real sample has something to compare against
+        psutil.cpu_percent(interval=None)
+
+    def sample_cpu(self):
+        with self.lock:
+            self.cpu_usage = round(psutil.cpu_percent(interval=None), 2)
+            return self.cpu_usage
+
+    def get_cpu(self):
+        return self.cpu_usage
+
+
+host_metrics = HostMetrics()
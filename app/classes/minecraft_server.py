@@ -2,25 +2,87 @@ import os
 import re
 import json
 import time
+import shlex
 import psutil
 import schedule
 import datetime
 import threading
+import subprocess
 import logging.config
 
-
-import pexpect
-from pexpect.popen_spawn import PopenSpawn
-
 from app.classes.mc_ping import ping
 from app.classes.console import console
-from app.classes.models import History, Remote, MC_settings, Crafty_settings, model_to_dict, Backups
+from app.classes.console_buffer import ConsoleBuffer
+from app.classes.event_bus import event_bus
+from app.classes.metrics import ProcessMetrics
+from app.classes.world_size import WorldSizeIndex
+from app.classes.timeseries import TimeSeries, SERIES_SECONDS
+from app.classes.fs_watcher import fs_watcher
+from app.classes.server_props import server_props_cache
+from app.classes.command_queue import command_queue
+from app.classes.models import History, MC_settings, Crafty_settings, model_to_dict, Backups, Server_Startups
 from app.classes.ftp import ftp_svr_object
 from app.classes.helpers import helper
 from app.classes.webhookmgr import webhookmgr
 
 logger = logging.getLogger(__name__)
 
+# server lifecycle states
+STATE_STOPPED = "stopped"
+STATE_STARTING = "starting"
+STATE_RUNNING = "running"
+STATE_STOPPING = "stopping"
+STATE_CRASHED = "crashed"
+STATE_BACKOFF = "backoff"
+
+# states where the java process is alive
+ALIVE_STATES = (STATE_STARTING, STATE_RUNNING, STATE_STOPPING)
+
+# states a server can be started from
+STARTABLE_STATES = (STATE_STOPPED, STATE_CRASHED, STATE_BACKOFF)
+
+# console lines that mean the server has finished starting up
+# vanilla / spigot / paper / forge / velocity: [Server thread/INFO]: Done (12.345s)! For help, type "help"
+READY_DONE_RE = re.compile(r'Done \((?P<seconds>[0-9.,]+)s\)!')
+# bungee / waterfall: [INFO] Listening on /0.0.0.0:25577
+READY_LISTENING_RE = re.compile(r'Listening on /')
+
+# how long a server gets to exit after SIGTERM before we SIGKILL it
+TERMINATE_TIMEOUT = 10
+
+# if we never see a ready line (custom jars, old versions), call the server running after this many seconds
+STARTUP_TIMEOUT = 300
+
+# the stats run reports cpu averaged over this many seconds of the per second samples
+STATS_WINDOW = 10
+
+
+def split_args(args):
+    """
+    Splits the extra java / server arguments from the settings into a list for Popen
+
+    On Windows shlex has to run in non-posix mode (so backslashes in paths survive), which leaves the
+    quotes on quoted tokens - Popen would then escape them, so they are stripped here
+
+    Args:
+        args (string): the arguments as typed in the config page
+
+    Returns:
+        list: one string per argument
+    """
+    if os.name != "nt":
+        return shlex.split(args or '')
+
+    tokens = []
+
+    for token in shlex.split(args or '', posix=False):
+        if len(token) >= 2 and token[0] == token[-1] and token[0] in ('"', "'"):
+            token = token[1:-1]
+
+        tokens.append(token)
+
+    return tokens
+
 
 class Minecraft_Server():
 
@@ -31,28 +93,79 @@ class Minecraft_Server():
         self.PID = None
         self.start_time = None
         self.server_jar = None
-        self.server_command = None
+        self.server_args = []
         self.server_path = None
         self.server_thread = None
         self.settings = None
         self.updating = False
         self.jar_exists = False
         self.java_path_exists = False
+        self.args_valid = False
         self.server_id = None
         self.name = None
-        self.is_crashed = False
         self.restart_count = 0
 
-    def reload_settings(self):
-        logger.info("Reloading MC Settings from the DB")
+        # where we are in the server lifecycle - only ever changed through set_state()
+        self.state = STATE_STOPPED
+        self.state_lock = threading.Lock()
+
+        # set while we are deliberately stopping the server, so the exit watcher knows it wasn't a crash
+        self.stopping = False
+        self.exit_watcher = None
+
+        # monotonic clock reading of when the exit watcher saw the process exit, None while it hasn't
+        self.exit_time = None
+
+        # startup timing - launch_time is a monotonic clock reading, not a date
+        self.launch_time = None
+        self.startup_timer = None
+        self.last_startup_seconds = None
+
+        # the last lines the server wrote to stdout, kept in memory with a fixed size
+        self.console_buffer = ConsoleBuffer()
+        self.console_buffer.add_listener(self.check_for_ready_line)
+
+        # one psutil handle for the life of the process, so cpu can be sampled without sleeping
+        self.process_metrics = ProcessMetrics()
+
+        # the last hour at one second resolution, filled by the metrics sampler in multiserv
+        self.timeseries = TimeSeries()
+        self.last_usage = None
+        self.last_players = 0
+
+        # region directory sizes, so the stats run doesn't walk the whole server tree every time
+        self.world_size_index = WorldSizeIndex()
 
-        self.settings = MC_settings.get_by_id(self.server_id)
+    def reload_settings(self, settings=None):
+        """
+        Args:
+            settings (MC_settings): the row to use, usually the one multiserv already holds - None = read it from the DB
+        """
+        if settings is None:
+            logger.info("Reloading MC Settings from the DB")
+            settings = MC_settings.get_by_id(self.server_id)
+
+        self.settings = settings
+        self.name = settings.server_name
 
         self.setup_server_run_command()
 
+    def refresh_settings(self):
+        # goes through multi, so its cached settings and the fleet snapshot stay in step with ours
+        # imported here - multiserv imports this module
+        from app.classes.multiserv import multi
+
+        if not multi.reload_server_settings(self.server_id):
+            self.reload_settings()
+
     def get_mc_server_name(self, server_id=None):
         if server_id is None:
             server_id = self.server_id
+
+        # our own name is already in memory
+        if self.settings is not None and int(server_id) == int(self.server_id):
+            return self.settings.server_name
+
         server_data = MC_settings.get_by_id(server_id)
         return server_data.server_name
 
@@ -83,12 +196,11 @@ class Minecraft_Server():
             logger.info("Auto Start is Disabled")
             console.info("Auto Start is Disabled")
 
-    def do_init_setup(self, server_id):
+    def do_init_setup(self, server_id, settings=None):
 
         if helper.is_setup_complete():
             self.server_id = server_id
-            self.name = self.get_mc_server_name(self.server_id)
-            self.reload_settings()
+            self.reload_settings(settings)
 
         logger.debug("Loading Minecraft server object for server %s-%s", server_id, self.name)
         console.info("Loading Minecraft server object for server {}-{}".format(server_id, self.name))
@@ -107,36 +219,31 @@ class Minecraft_Server():
         server_pre_args = self.settings.pre_args
         java_path = self.settings.java_path
 
-        # set up execute path if we have spaces, we put quotes around it for windows
-        if " " in server_path:
-            exec_path = '"{}"'.format(server_path)
-        else:
-            exec_path = server_path
-
-        # Wrap Java path in quotes if it contains spaces
-        if " " in java_path:
-            java_exec = '"{}"'.format(java_path)
-        else:
-            java_exec = java_path
+        # the argument list we actually exec - no shell in between, so no quoting is needed here
+        self.server_args = [java_path]
 
-        server_exec_path = os.path.join(exec_path, server_jar)
         if int(server_min_mem) >= 0:
-            self.server_command = '{} -Xms{}M -Xmx{}M {} -jar {} nogui {}'.format(
-                                                                                java_exec,
-                                                                                server_min_mem,
-                                                                                server_max_mem,
-                                                                                server_pre_args,
-                                                                                server_exec_path,
-                                                                                server_args
-                                                                                )
-        else:
-            self.server_command = '{} -Xmx{}M {} -jar {} nogui {}'.format(
-                                                                        java_exec,
-                                                                        server_max_mem,
-                                                                        server_pre_args,
-                                                                        server_exec_path,
-                                                                        server_args
-                                                                        )
+            self.server_args.append('-Xms{}M'.format(server_min_mem))
+
+        self.server_args.append('-Xmx{}M'.format(server_max_mem))
+
+        try:
+            self.server_args += split_args(server_pre_args)
+            self.server_args += ['-jar', os.path.join(server_path, server_jar), 'nogui']
+            self.server_args += split_args(server_args)
+            self.args_valid = True
+        except ValueError as e:
+            # shlex gives up on an unbalanced quote - start_server() won't run until the config is fixed
+            console.warning("Unable to read the Java arguments for server {}: {}".format(self.settings.server_name, e))
+            logger.critical("Unable to read the Java arguments for server %s (%s) - check the quotes in the server config",
+                            self.settings.server_name, e)
+            self.args_valid = False
+
+        # keep an in memory copy of the server directory, so we aren't asking the disk all the time
+        if self.server_path is not None and self.server_path != server_path:
+            fs_watcher.unwatch(self.server_path.replace('"', ''))
+
+        fs_watcher.watch(server_path.replace('"', ''))
 
         self.server_path = server_path
         self.jar_exists = helper.check_file_exists(os.path.join(server_path, server_jar))
@@ -147,9 +254,43 @@ class Minecraft_Server():
         else:
             self.java_path_exists = helper.check_file_exists(java_path)
 
-    def run_threaded_server(self):
+    def set_state(self, new_state, from_states=None):
+        """
+        Moves the server to a new lifecycle state and publishes a server_state_changed event
+
+        Args:
+            new_state (string): one of the STATE_* constants
+            from_states (tuple): only make the change if we are currently in one of these states
+
+        Returns:
+            bool: True = state changed (or was already new_state), False = we weren't in from_states
+        """
+        with self.state_lock:
+            old_state = self.state
+
+            if from_states is not None and old_state not in from_states:
+                return False
+
+            if old_state == new_state:
+                return True
+
+            self.state = new_state
+
+        logger.info("Minecraft server %s changed state from %s to %s", self.name, old_state, new_state)
+
+        event_bus.publish("server_state_changed",
+                          server_id=self.server_id,
+                          server_name=self.name,
+                          old_state=old_state,
+                          new_state=new_state)
+        return True
+
+    def get_state(self):
+        return self.state
+
+    def run_threaded_server(self, from_states=STARTABLE_STATES):
         # start the server
-        self.server_thread = threading.Thread(target=self.start_server, daemon=True)
+        self.server_thread = threading.Thread(target=self.start_server, args=(from_states, ), daemon=True)
         self.server_thread.start()
 
     def stop_threaded_server(self):
@@ -158,7 +299,7 @@ class Minecraft_Server():
         if self.server_thread:
             self.server_thread.join()
 
-    def start_server(self):
+    def start_server(self, from_states=STARTABLE_STATES):
 
         # fail safe in case we try to start something already running
         if self.check_running():
@@ -175,62 +316,130 @@ class Minecraft_Server():
             logger.critical("Minecraft server Java path does not exist...")
             return False
 
+        if not self.args_valid:
+            console.warning("Minecraft server Java arguments are invalid...")
+            logger.critical("Minecraft server Java arguments are invalid - check the quotes in the server config")
+            return False
+
 
         if not helper.check_writeable(self.server_path):
             console.warning("Unable to write/access {}".format(self.server_path))
             logger.critical("Unable to write/access {}".format(self.server_path))
             return False
 
-        logger.info("Launching Minecraft server %s with command %s", self.name, self.server_command)
-
-        if os.name == "nt":
-            logger.info("Windows Detected - launching cmd")
-            self.server_command = self.server_command.replace('\\', '/')
-            logging.info("Opening CMD prompt")
-            self.process = pexpect.popen_spawn.PopenSpawn('cmd \r\n', timeout=None, encoding=None)
-
-            drive_letter = self.server_path[:1]
+        # make sure two start requests can't both get past here
+        if not self.set_state(STATE_STARTING, from_states=from_states):
+            logger.error("Server %s is %s - Cancelling Startup", self.name, self.state)
+            return False
 
-            if drive_letter.lower() != "c":
-                logger.info("Server is not on the C drive, changing drive letter to {}:".format(drive_letter))
-                self.process.send("{}:\r\n".format(drive_letter))
+        self.stopping = False
+        self.exit_time = None
+        logger.info("Launching Minecraft server %s with command %s", self.name, subprocess.list2cmdline(self.server_args))
 
-            logging.info("changing directories to {}".format(self.server_path.replace('\\', '/')))
-            self.process.send('cd {} \r\n'.format(self.server_path.replace('\\', '/')))
-            logging.info("Sending command {} to CMD".format(self.server_command))
-            self.process.send(self.server_command + "\r\n")
+        try:
+            self.process = subprocess.Popen(
+                self.server_args,
+                cwd=self.server_path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+        except (OSError, ValueError) as e:
+            logger.critical("Unable to launch Minecraft server %s: %s", self.name, e)
+            console.warning("Unable to launch Minecraft server {}: {}".format(self.name, e))
+            self.process = None
+            self.set_state(STATE_CRASHED)
+            return False
 
-            self.is_crashed = False
-        else:
-            logger.info("Linux Detected - launching Bash")
-            self.process = pexpect.popen_spawn.PopenSpawn('/bin/bash \n', timeout=None, encoding=None)
+        self.PID = self.process.pid
+        self.launch_time = time.monotonic()
+        self.process_metrics.attach(self.PID)
 
-            logger.info("Changing directory to %s", self.server_path)
-            self.process.send('cd {} \n'.format(self.server_path))
+        # drain stdout in the background so the pipe never fills up and blocks the server
+        self.console_buffer.start_reader(self.process.stdout, self.name)
 
-            logger.info("Sending server start command: {} to shell".format(self.server_command))
-            self.process.send(self.server_command + '\n')
-            self.is_crashed = False
+        # block on the process in the background, so we know the instant it exits
+        self.exit_watcher = threading.Thread(target=self.watch_for_exit,
+                                             args=(self.process, ),
+                                             daemon=True,
+                                             name="exit_watcher_{}".format(self.name))
+        self.exit_watcher.start()
 
         ts = time.time()
         self.start_time = str(datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'))
 
-        if psutil.pid_exists(self.process.pid):
-            parent = psutil.Process(self.process.pid)
-            time.sleep(.5)
-            children = parent.children(recursive=True)
-            for c in children:
-                self.PID = c.pid
-                logger.info("Minecraft server %s running with PID %s", self.name, self.PID)
-                webhookmgr.run_event_webhooks("mc_start", webhookmgr.payload_formatter(200, {}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None , "PID": self.PID, "restart_count": self.restart_count}}, {"info": "Minecraft Server has started"}))
-                self.is_crashed = False
+        if self.process.poll() is None:
+            logger.info("Minecraft server %s launched with PID %s - waiting for it to finish starting", self.name, self.PID)
+
+            # the server moves to running when check_for_ready_line sees it's done, or when this timer gives up waiting
+            self.startup_timer = threading.Timer(STARTUP_TIMEOUT, self.startup_timed_out)
+            self.startup_timer.daemon = True
+            self.startup_timer.start()
         else:
             webhookmgr.run_event_webhooks("mc_start", webhookmgr.payload_formatter(500, {"error": "SER_DIED"}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None , "PID": self.PID, "restart_count": self.restart_count}}, {"info": "Minecraft Server died right after startup! Config issue?"}))
             logger.warning("Server PID %s died right after starting - is this a server config issue?", self.PID)
 
         if self.settings.crash_detection:
-            logger.info("Server %s has crash detection enabled - starting watcher task", self.name)
-            schedule.every(30).seconds.do(self.check_running).tag(self.name)
+            logger.info("Server %s has crash detection enabled", self.name)
+
+    def check_for_ready_line(self, seq, line):
+        # called by the console reader for every line - cheap unless we are starting
+        if self.state != STATE_STARTING:
+            return
+
+        done = READY_DONE_RE.search(line)
+
+        if done:
+            try:
+                startup_seconds = float(done.group('seconds').replace(',', '.'))
+            except ValueError:
+                startup_seconds = None
+
+            self.run_server_ready(startup_seconds)
+
+        elif READY_LISTENING_RE.search(line):
+            self.run_server_ready(None)
+
+    def run_server_ready(self, startup_seconds):
+        # the db write and webhooks can be slow - don't hold up the console reader with them
+        threading.Thread(target=self.server_ready, args=(startup_seconds, ), daemon=True).start()
+
+    def startup_timed_out(self):
+        if self.state == STATE_STARTING:
+            logger.warning("Didn't see a startup complete line from server %s after %s seconds - assuming it is running",
+                           self.name, STARTUP_TIMEOUT)
+            self.server_ready(None)
+
+    def server_ready(self, startup_seconds):
+        if not self.set_state(STATE_RUNNING, from_states=(STATE_STARTING, )):
+            return
+
+        if self.startup_timer is not None:
+            self.startup_timer.cancel()
+            self.startup_timer = None
+
+        wall_seconds = round(time.monotonic() - self.launch_time, 3)
+        self.last_startup_seconds = startup_seconds if startup_seconds is not None else wall_seconds
+
+        logger.info("Minecraft server %s is ready - startup took %ss (server reported %ss)",
+                    self.name, wall_seconds, startup_seconds)
+
+        # keep a record of every startup, so slow starts after a jar update stand out
+        Server_Startups.insert({
+            Server_Startups.server_id: self.server_id,
+            Server_Startups.server_jar: self.settings.server_jar,
+            Server_Startups.startup_seconds: startup_seconds,
+            Server_Startups.wall_seconds: wall_seconds
+        }).execute()
+
+        webhookmgr.run_event_webhooks("mc_start", webhookmgr.payload_formatter(200, {}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None , "PID": self.PID, "restart_count": self.restart_count, "startup_seconds": self.last_startup_seconds}}, {"info": "Minecraft Server has started"}))
+
+    def get_startup_history(self, limit=20):
+        query = Server_Startups.select().where(
+            Server_Startups.server_id == self.server_id
+        ).order_by(Server_Startups.time.desc()).limit(limit)
+
+        return [model_to_dict(s) for s in query]
 
     def send_command(self, command):
 
@@ -238,23 +447,29 @@ class Minecraft_Server():
             logger.warning("Server not running, unable to send command \"%s\"", command)
             return False
 
-        logger.debug("Sending command %s to server via pexpect", command)
+        logger.debug("Sending command %s to server via stdin", command)
 
         # send it
-        self.process.send(command + '\n')
+        try:
+            self.process.stdin.write((command + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (OSError, ValueError, AttributeError):
+            logger.warning("Unable to write command \"%s\" to server %s - the process is gone", command, self.name)
+            return False
 
     def restart_threaded_server(self):
-        Remote.insert({
-            Remote.command: 'restart_mc_server',
-            Remote.server_id: self.server_id,
-            Remote.command_source: 'local'
-        }).execute()
+        command_queue.put('restart_mc_server', self.server_id, 'local')
 
-    def stop_server(self):
+    def request_stop(self):
+        # asks the server to shut itself down, and returns straight away
 
         # remove any scheduled tasks for this server
         schedule.clear(self.name)
 
+        # let the exit watcher know this exit is on purpose
+        self.stopping = True
+        self.set_state(STATE_STOPPING, from_states=(STATE_STARTING, STATE_RUNNING))
+
         if self.detect_bungee_waterfall():
             logger.info('Waterfall/Bungee Detected: Sending shutdown command "end" to server ID:{} - {}'.format(
                 self.server_id, self.name))
@@ -264,32 +479,111 @@ class Minecraft_Server():
             logger.info('Sending shutdown command "stop" to server ID:{} - {}'.format(self.server_id, self.name))
             self.send_command("stop")
 
-        for x in range(6):
-            self.PID = None
+    def cancel_restart(self):
+        """
+        Stops a crashed server that is waiting to be restarted from being started again
 
-            if self.check_running(True):
-                logger.debug("Polling says Minecraft server %s is running", self.name)
-                time.sleep(10)
+        Returns:
+            bool: True = it was waiting and won't restart now, False = it wasn't waiting (or had already started)
+        """
+        # the restart only goes ahead from STATE_BACKOFF, so moving out of it is enough
+        if self.set_state(STATE_STOPPED, from_states=(STATE_BACKOFF, )):
+            logger.info("Cancelled the pending restart of server %s", self.name)
+            return True
 
-            # now the server is dead, we set process to none
-            else:
-                logger.debug("Minecraft server %s has stopped", self.name)
+        return False
 
-                self.cleanup_server_object()
+    def wait_for_exit(self, timeout=None):
+        """
+        Blocks until the server process exits, or the timeout runs out
 
-                # return true as the server is down
-                webhookmgr.run_event_webhooks("mc_stop", webhookmgr.payload_formatter(200, {}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None, "PID": self.PID, "restart_count": self.restart_count}}, {"info": "Minecraft Server has stopped"}))
-                return True
+        Args:
+            timeout (float): seconds to wait, None = forever
+
+        Returns:
+            bool: True = the process is gone, False = still running after the timeout
+        """
+        process = self.process
+
+        if process is None:
+            return True
+
+        try:
+            process.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    def terminate_process(self):
+        # SIGTERM (TerminateProcess on windows) - the jvm runs its shutdown hooks, so the world still gets saved
+        process = self.process
+
+        if process is not None and process.poll() is None:
+            logger.warning("Sending SIGTERM to Minecraft server %s (PID %s)", self.name, process.pid)
+            try:
+                process.terminate()
+            except OSError:
+                pass
+
+    def kill_process(self):
+        process = self.process
+
+        if process is not None and process.poll() is None:
+            try:
+                self.killpid(process.pid)
+            except psutil.NoSuchProcess:
+                pass
+
+    def stop_server(self):
+        stop_started = time.monotonic()
+        graceful_timeout = self.settings.stop_timeout
+
+        self.request_stop()
+
+        # block on the process itself, so we return the moment it exits
+        if self.wait_for_exit(graceful_timeout):
+            stop_seconds = round(time.monotonic() - stop_started, 3)
+            logger.info("Minecraft server %s has stopped in %s seconds", self.name, stop_seconds)
+
+            self.cleanup_server_object()
 
-        # if we got this far, the server isn't responding, and needs to be forced down
-        logger.critical("Unable to stop the server %s. Terminating it via SIGKILL > %s", self.name, self.PID)
-        webhookmgr.run_event_webhooks("mc_stop", webhookmgr.payload_formatter(500, {"error": "SER_STOP_FAIL"}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None, "PID": self.PID, "restart_count": self.restart_count}}, {"info": "Minecraft Server has not gracefully stopped. Terminating."}))
+            # return true as the server is down
+            self.send_stop_webhook(stop_seconds)
+            return True
+
+        # if we got this far, the server isn't responding, so we ask the jvm to shut down, then force it down
+        logger.critical("Server %s didn't stop within %s seconds. Terminating it via SIGTERM > %s", self.name, graceful_timeout, self.PID)
+        self.terminate_process()
+
+        if not self.wait_for_exit(TERMINATE_TIMEOUT):
+            logger.critical("Unable to stop the server %s. Terminating it via SIGKILL > %s", self.name, self.PID)
+            self.kill_process()
+            self.wait_for_exit(TERMINATE_TIMEOUT)
+
+        stop_seconds = round(time.monotonic() - stop_started, 3)
+        self.send_stop_webhook(stop_seconds, graceful=False)
+
+        self.cleanup_server_object()
+        return False
 
-        self.killpid(self.PID)
+    def send_stop_webhook(self, stop_seconds, graceful=True):
+        """
+        Sends the mc_stop event webhooks
+
+        Args:
+            stop_seconds (float): how long the server took to stop
+            graceful (bool): False = it had to be terminated or killed
+        """
+        server = {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None, "PID": self.PID, "restart_count": self.restart_count, "stop_seconds": stop_seconds}
+
+        if graceful:
+            webhookmgr.run_event_webhooks("mc_stop", webhookmgr.payload_formatter(200, {}, {"server": server}, {"info": "Minecraft Server has stopped"}))
+        else:
+            webhookmgr.run_event_webhooks("mc_stop", webhookmgr.payload_formatter(500, {"error": "SER_STOP_FAIL"}, {"server": server}, {"info": "Minecraft Server has not gracefully stopped. Terminating."}))
 
     def crash_detected(self, name):
         # let's make sure the settings are setup right
-        self.reload_settings()
+        self.refresh_settings()
 
         # the server crashed, or isn't found - so let's reset things.
         logger.warning("The server %s seems to have vanished unexpectedly, did it crash?", name)
@@ -297,78 +591,100 @@ class Minecraft_Server():
         if self.settings.crash_detection:
             logger.info("The server %s has crashed and will be restarted. Restarting server", name)
             webhookmgr.run_event_webhooks("mc_crashed", webhookmgr.payload_formatter(200, {}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None, "PID": self.PID, "restart_count": self.restart_count}}, {"info": "Minecraft Server has crashed"}))
-            self.run_threaded_server()
+            # only if we are still waiting to restart - cancel_restart() may have stopped us in the meantime
+            self.run_threaded_server(from_states=(STATE_BACKOFF, ))
             return True
         else:
             webhookmgr.run_event_webhooks("mc_crashed_no_restart", webhookmgr.payload_formatter(200, {}, {"server": {"name": self.get_mc_server_name(), "id": self.server_id, "running": not self.PID is None, "PID": self.PID, "restart_count": self.restart_count}}, {"info": "Minecraft Server has crashed too much, auto restart disabled"}))
             logger.info("The server %s has crashed, crash detection is disabled and it will not be restarted", name)
             return False
 
-    def check_running(self, shutting_down=False):
-        # if process is None, we never tried to start
-        if self.PID is None:
-            return False
+    def watch_for_exit(self, process):
+        # wait() blocks on waitpid, so this returns as soon as the JVM exits - no polling
+        exit_code = process.wait()
 
-        if not self.jar_exists:
-            return False
+        # a newer process has been started since, this one doesn't matter anymore
+        if process is not self.process:
+            return
 
-        running = psutil.pid_exists(self.PID)
+        self.exit_time = time.monotonic()
 
-        if not running:
+        if self.startup_timer is not None:
+            self.startup_timer.cancel()
+            self.startup_timer = None
 
-            # did the server crash?
-            if not shutting_down:
+        if self.stopping:
+            logger.info("Minecraft server %s exited with code %s after being asked to stop", self.name, exit_code)
+            self.set_state(STATE_STOPPED)
+            return
 
-                # do we have crash detection turned on?
-                if self.settings.crash_detection:
+        logger.warning("Minecraft server %s exited unexpectedly with code %s", self.name, exit_code)
+        self.handle_unexpected_exit(exit_code)
 
-                    # if we haven't tried to restart more 3 or more times
-                    if self.restart_count <= 3:
+    def handle_unexpected_exit(self, exit_code):
+        # do we have crash detection turned on?
+        if self.settings.crash_detection:
+            self.set_state(STATE_CRASHED)
 
-                        # start the server if needed
-                        server_restarted = self.crash_detected(self.name)
+            # if we haven't tried to restart more 3 or more times
+            if self.restart_count <= 3:
 
-                        if server_restarted:
-                            # add to the restart count
-                            self.restart_count = self.restart_count + 1
-                            return False
+                # wait a little longer after each failed attempt, so a broken server doesn't spin
+                delay = min(5 * 2 ** self.restart_count, 60)
+                logger.info("Waiting %s seconds before restarting server %s", delay, self.name)
+                self.set_state(STATE_BACKOFF)
+                time.sleep(delay)
 
-                    # we have tried to restart 4 times...
-                    elif self.restart_count == 4:
-                        logger.warning("Server %s has been restarted %s times. It has crashed, not restarting.",
-                                       self.name, self.restart_count)
+                # someone else started or stopped the server while we were waiting
+                if self.state != STATE_BACKOFF:
+                    return
 
-                        # set to 99 restart attempts so this elif is skipped next time. (no double logging)
-                        self.restart_count = 99
-                        self.is_crashed = True
-                        return False
-                    else:
-                        self.is_crashed = True
-                        return False
+                # start the server if needed
+                server_restarted = self.crash_detected(self.name)
 
-                return False
+                if server_restarted:
+                    # add to the restart count
+                    self.restart_count = self.restart_count + 1
+                else:
+                    self.set_state(STATE_CRASHED, from_states=(STATE_BACKOFF, ))
 
-            self.cleanup_server_object()
+            # we have tried to restart 4 times...
+            elif self.restart_count == 4:
+                logger.warning("Server %s has been restarted %s times. It has crashed, not restarting.",
+                               self.name, self.restart_count)
 
-            return False
+                # set to 99 restart attempts so this elif is skipped next time. (no double logging)
+                self.restart_count = 99
 
+        # a clean exit we didn't ask for (someone typed stop in the console) isn't a crash
+        elif exit_code == 0:
+            self.cleanup_server_object()
         else:
-            self.is_crashed = False
-            return True
+            self.set_state(STATE_CRASHED)
+
+    def check_running(self):
+        # a pure read of the cached state - the exit watcher keeps it up to date, nothing is probed here
+        return self.state in ALIVE_STATES
 
     def cleanup_server_object(self):
+        if self.startup_timer is not None:
+            self.startup_timer.cancel()
+            self.startup_timer = None
+
+        self.process_metrics.detach()
+        self.last_usage = None
+        self.last_players = 0
+
         self.PID = None
         self.start_time = None
         self.restart_count = 0
-        self.is_crashed = False
         self.updating = False
+        self.stopping = False
         self.process = None
+        self.set_state(STATE_STOPPED)
 
     def check_crashed(self):
-        if not self.check_running():
-            return self.is_crashed
-        else:
-            return False
+        return self.state in (STATE_CRASHED, STATE_BACKOFF)
 
     def killpid(self, pid):
         logger.info("Terminating PID %s and all child processes", pid)
@@ -383,28 +699,86 @@ class Minecraft_Server():
         logger.info('Sending SIGKILL to parent')
         process.kill()
 
+    def get_uptime(self):
+        # seconds since we launched the process, 0 if it isn't running
+        if self.check_running() and self.launch_time is not None:
+            return time.monotonic() - self.launch_time
+
+        return 0
+
     def get_start_time(self):
         if self.check_running():
             return self.start_time
         else:
             return False
 
+    def sample_metrics(self, stamp=None):
+        # called every second by the metrics sampler in multiserv
+        usage = self.process_metrics.sample()
+
+        if usage is None:
+            return
+
+        self.last_usage = usage
+        self.timeseries.record(stamp,
+                               cpu=usage['cpu_usage'],
+                               memory=usage['memory_percent'],
+                               players=self.last_players)
+
+    def get_recent_usage(self, seconds=STATS_WINDOW):
+        """
+        Returns:
+            dict: like ProcessMetrics.sample(), with cpu averaged over the last few seconds of samples
+        """
+        cpu = self.timeseries.get_average('cpu', seconds)
+        usage = self.last_usage
+
+        if cpu is None or usage is None:
+            # the sampler isn't running (or hasn't got to us yet) - take a sample ourselves
+            return self.process_metrics.sample()
+
+        usage = dict(usage)
+        usage['cpu_usage'] = round(cpu, 2)
+        return usage
+
     def write_usage_history(self):
-        server_stats = {
-            'cpu_usage': psutil.cpu_percent(interval=0.5) / psutil.cpu_count(),
-            'mem_percent': psutil.virtual_memory()[2]
-            }
-        try:
-            server_ping = self.ping_server()
-        except:
-            server_ping = False
-            pass
+        # the history table only gets one point per interval, averaged from the per second samples
+        history_interval = Crafty_settings.get_by_id(1).history_interval
+        window = min(int(history_interval) * 60, SERIES_SECONDS)
 
-        if server_ping:
-            online_stats = json.loads(server_ping.players)
-            online_data = {'online': online_stats.get('online', 0)}
+        cpu = self.timeseries.get_average('cpu', window)
+
+        if cpu is not None:
+            server_stats = {
+                'cpu_usage': round(cpu, 2),
+                'mem_percent': round(self.timeseries.get_average('memory', window), 2)
+            }
+            online_data = {'online': int(self.timeseries.get_max('players', window))}
         else:
-            online_data = {'online': 0}
+            # no samples in the window (the sampler isn't running) - sample the process ourselves, these
+            # columns are this server's share of the host, never the host's own numbers
+            usage = self.process_metrics.sample() if self.check_running() else None
+
+            if usage is None:
+                logger.debug("No usage samples for server %s, not writing a history record", self.server_id)
+                return
+
+            server_stats = {
+                'cpu_usage': usage['cpu_usage'],
+                'mem_percent': usage['memory_percent']
+            }
+
+            try:
+                server_ping = self.ping_server()
+            except:
+                server_ping = False
+                pass
+
+            if server_ping:
+                online_stats = json.loads(server_ping.players)
+                online_data = {'online': online_stats.get('online', 0)}
+            else:
+                online_data = {'online': 0}
 
         # write performance data to db
         insert_result = History.insert({
@@ -416,52 +790,45 @@ class Minecraft_Server():
 
         logger.debug("Inserted history record number %s", insert_result)
 
-        query = Crafty_settings.select(Crafty_settings.history_max_age)
-        max_days = query[0].history_max_age
-
-        # auto-clean on max days
-        max_age = datetime.datetime.now() - datetime.timedelta(days=max_days)
-
-        # delete items older than 1 week
-        History.delete().where(History.time < max_age).execute()
+        # old records are rolled up and pruned by historymgr.do_rollups(), not on every insert
 
     def get_mc_process_stats(self):
 
         world_data = self.get_world_info()
-        server_settings = MC_settings.get(self.server_id)
-        server_settings_dict = model_to_dict(server_settings)
 
-        if self.check_running():
-            p = psutil.Process(self.PID)
-
-            # call it first so we can be more accurate per the docs
-            # https://giamptest.readthedocs.io/en/latest/#psutil.Process.cpu_percent
-
-            dummy = p.cpu_percent()
-            real_cpu = round(p.cpu_percent(interval=0.5) / psutil.cpu_count(), 2)
-
-            # this is a faster way of getting data for a process
-            with p.oneshot():
-                server_stats = {
-                    'server_start_time': self.get_start_time(),
-                    'server_running': self.check_running(),
-                    'cpu_usage': real_cpu,
-                    'memory_usage': helper.human_readable_file_size(p.memory_info()[0]),
-                    'world_name': world_data['world_name'],
-                    'world_size': world_data['world_size'],
-                    'server_ip': server_settings_dict['server_ip'],
-                    'server_port': server_settings_dict['server_port']
-                    }
+        # the port the server really listens on, if it has a server.properties
+        props = self.get_server_props()
+        server_ip = self.settings.server_ip
+        server_port = props.server_port if props is not None else self.settings.server_port
+
+        # cpu is averaged from the per second samples we already have, so this doesn't sleep
+        usage = self.get_recent_usage() if self.check_running() else None
+
+        if usage is not None:
+            server_stats = {
+                'server_start_time': self.get_start_time(),
+                'server_running': self.check_running(),
+                'cpu_usage': usage['cpu_usage'],
+                'memory_usage': helper.human_readable_file_size(usage['memory_bytes']),
+                'memory_bytes': usage['memory_bytes'],
+                'world_name': world_data['world_name'],
+                'world_size': world_data['world_size'],
+                'world_bytes': world_data['world_bytes'],
+                'server_ip': server_ip,
+                'server_port': server_port
+                }
         else:
             server_stats = {
                 'server_start_time': "Not Started",
                 'server_running': False,
                 'cpu_usage': 0,
                 'memory_usage': "0 MB",
+                'memory_bytes': 0,
                 'world_name': world_data['world_name'],
                 'world_size': world_data['world_size'],
-                'server_ip': server_settings_dict['server_ip'],
-                'server_port': server_settings_dict['server_port']
+                'world_bytes': world_data['world_bytes'],
+                'server_ip': server_ip,
+                'server_port': server_port
             }
 
         # are we pingable?
@@ -479,7 +846,12 @@ class Minecraft_Server():
             server_stats.update({'server_description': server_ping.description})
             server_stats.update({'server_version': server_ping.version})
 
+            # the per second samples carry this forward until the next ping
+            self.last_players = online_stats.get('online', 0) or 0
+
         else:
+            self.last_players = 0
+
             server_stats.update({'online': 0})
             server_stats.update({'max': 0})
             server_stats.update({'players': []})
@@ -553,74 +925,58 @@ class Minecraft_Server():
 
         results = []
 
-        for dirpath, dirnames, filenames in os.walk(backup_path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                # skip if it is symbolic link
-                if not os.path.islink(fp):
-                    size = helper.human_readable_file_size(os.path.getsize(fp))
+        if not os.path.isdir(backup_path):
+            return results
+
+        fs_watcher.watch(backup_path)
+
+        for dirpath, entries in fs_watcher.walk(backup_path):
+            for f, entry in entries.items():
+                # skip directories and symbolic links
+                if not entry['is_dir'] and not entry['is_link']:
+                    size = helper.human_readable_file_size(entry['size'])
                     results.append({'path': f, 'size': size})
 
         return results
 
+    def get_server_props(self):
+        """
+        Returns:
+            ServerProps: this server's parsed server.properties (shared, only parsed again when the file changes),
+                         or None if there isn't one
+        """
+        server_prop_file = os.path.join(self.server_path.replace('"', ''), 'server.properties')
+        return server_props_cache.get(server_prop_file)
+
     def get_world_name(self):
-        search_string = 'level-name*'
-        worldname = self.search_server_properties(search_string)
-        if worldname:
-            return worldname
-        else:
-            return "Not Found"
+        props = self.get_server_props()
+
+        if props is not None:
+            return props.level_name
+
+        elif self.detect_bungee_waterfall():
+            return "Bungee/Waterfall Detected"
+
+        # if we got here, we can't find server.properties (bigger issues)
+        logger.warning("Unable to find server.properties file")
+        return "Not Found"
 
     def detect_bungee_waterfall(self):
         bungee_waterfall_file = os.path.join(self.server_path.replace('"', ''), 'config.yml')
-        if helper.check_file_exists(bungee_waterfall_file):
+        if fs_watcher.stat(bungee_waterfall_file):
             return True
         else:
             return False
 
-    # returns the first setting that = the regex supplied
-    def search_server_properties(self, regex='*'):
-
-        # whats the file we are looking for?
-        server_prop_file = os.path.join(self.server_path.replace('"', ''), 'server.properties')
-        bungee_waterfall_file = os.path.join(self.server_path.replace('"', ''), 'config.yml')
-
-        # re of what we are looking for
-        # ignoring case - just in case someone used all caps
-        pattern = re.compile(regex, re.IGNORECASE)
-
-        # make sure it exists
-        if helper.check_file_exists(server_prop_file):
-            with open(server_prop_file, 'rt') as f:
-                for line in f:
-                    # if we find something
-                    if pattern.search(line) is not None:
-                        match_line = line.rstrip('\n').split("=", 2)
-
-                        # if we have at least 2 items in the list (i.e. there was an = char
-                        if len(match_line) == 2:
-                            return match_line[1]
-
-            # if we got here, we couldn't find it
-            logger.warning("Unable to find string using regex \"%s\" in server.properties file", regex)
-            return False
-
-        elif helper.check_file_exists(bungee_waterfall_file):
-            return "Bungee/Waterfall Detected"
+    def get_console_lines(self, since=0):
+        # if we have never seen any output (we didn't start this server), fall back to latest.log once
+        if self.console_buffer.last_seq == 0:
+            log_file = os.path.join(self.server_path, "logs", "latest.log")
 
-        # if we got here, we can't find server.properties (bigger issues)
-        logger.warning("Unable to find server.properties file")
-        return False
+            if helper.check_file_exists(log_file):
+                self.console_buffer.seed(helper.tail_file(log_file, 40))
 
-    # because this is a recursive function, we will return bytes, and set human readable later
-    def get_dir_size(self, path):
-        total = 0
-        for entry in os.scandir(path):
-            if entry.is_dir(follow_symlinks=False):
-                total += self.get_dir_size(entry.path)
-            else:
-                total += entry.stat(follow_symlinks=False).st_size
-        return total
+        return self.console_buffer.get_lines_since(since)
 
     def search_for_errors(self):
         log_file = os.path.join(self.server_path, "logs", "latest.log")
@@ -641,33 +997,22 @@ class Minecraft_Server():
         world = self.get_world_name()
 
         if world:
-            total_size = 0
-
-            # do a scan of the directories in the server path.
-            for root, dirs, files in os.walk(self.server_path, topdown=False):
-
-                # for each directory we find
-                for name in dirs:
-
-                    # if the directory name is "region"
-                    if name == "region":
-                        # log it!
-                        logger.debug("Path %s is called region. Getting directory size", os.path.join(root, name))
-
-                        # get this directory size, and add it to the total we have running.
-                        total_size += self.get_dir_size(os.path.join(root, name))
+            # the index only measures region directories that changed since we last asked
+            total_size = self.world_size_index.get_size(self.server_path)
 
             level_total_size = helper.human_readable_file_size(total_size)
 
             return {
                 'world_name': world,
-                'world_size': level_total_size
+                'world_size': level_total_size,
+                'world_bytes': total_size
             }
         else:
             logger.warning("Unable to find world disk data")
             return {
                 'world_name': 'Unable to find world name',
-                'world_size': 'Unable to find world size'
+                'world_size': 'Unable to find world size',
+                'world_bytes': 0
             }
 
     def is_server_pingable(self):
@@ -681,9 +1026,9 @@ class Minecraft_Server():
         server_port = 25565
         ip = "127.0.0.1"
 
-        settings = MC_settings.get_by_id(self.server_id)
-        server_port = settings.server_port
-        ip = settings.server_ip
+        if self.settings is not None:
+            server_port = self.settings.server_port
+            ip = self.settings.server_ip
 
         logger.debug("Pinging %s on port %s", ip, server_port)
         mc_ping = ping(ip, int(server_port))
@@ -691,7 +1036,7 @@ class Minecraft_Server():
 
     def update_server_jar(self, with_console=True):
 
-        self.reload_settings()
+        self.refresh_settings()
 
         self.updating = True
 
@@ -760,7 +1105,7 @@ class Minecraft_Server():
 
     def revert_updated_server_jar(self, with_console=True):
 
-        self.reload_settings()
+        self.refresh_settings()
 
         self.updating = True
 
@@ -857,6 +1202,9 @@ class Minecraft_Server():
         helper.delete_directory(world_end)
         time.sleep(2)
 
+        # the new world's region directories would otherwise only be found on the next discovery
+        self.world_size_index.invalidate()
+
         # restart server if it was running
         if was_running:
             logger.info("Restarting server: {}".format(self.name))
@@ -1,6 +1,8 @@
 import os
 import json
 import datetime
+import threading
+from types import MappingProxyType
 from peewee import DateTimeField, CharField, FloatField, Model, IntegerField, BooleanField, SqliteDatabase, AutoField
 from playhouse.shortcuts import model_to_dict, dict_to_model
 from playhouse.migrate import *
@@ -142,6 +144,7 @@ class MC_settings(BaseModel):
     server_port = IntegerField(default=25565)
     server_ip = CharField(default='127.0.0.1')
     jar_url = CharField(default='')
+    stop_timeout = IntegerField(default=60)
 
     class Meta:
         table_name = 'mc_settings'
@@ -152,6 +155,10 @@ class Crafty_settings(BaseModel):
     history_max_age = IntegerField()
     language = CharField(default='en_EN')
 
+    # days to keep each rollup tier - raw samples use history_max_age
+    history_5min_max_age = IntegerField(default=30)
+    history_hourly_max_age = IntegerField(default=365)
+
     class Meta:
         table_name = 'crafty_settings'
 
@@ -190,6 +197,51 @@ class History(BaseModel):
         table_name = 'history'
 
 
+class History_Rollup(BaseModel):
+    # one row per server per time bucket, time is the start of the bucket
+    server_id = IntegerField()
+    time = DateTimeField()
+    samples = IntegerField()
+    cpu_min = FloatField()
+    cpu_avg = FloatField()
+    cpu_max = FloatField()
+    memory_min = FloatField()
+    memory_avg = FloatField()
+    memory_max = FloatField()
+    players_min = IntegerField()
+    players_avg = FloatField()
+    players_max = IntegerField()
+
+
+class History_5min(History_Rollup):
+
+    class Meta:
+        table_name = 'history_5min'
+        indexes = (
+            (('server_id', 'time'), True),
+        )
+
+
+class History_Hourly(History_Rollup):
+
+    class Meta:
+        table_name = 'history_hourly'
+        indexes = (
+            (('server_id', 'time'), True),
+        )
+
+
+class Server_Startups(BaseModel):
+    server_id = IntegerField()
+    time = DateTimeField(default=datetime.datetime.now)
+    server_jar = CharField()
+    startup_seconds = FloatField(null=True)
+    wall_seconds = FloatField()
+
+    class Meta:
+        table_name = 'startups'
+
+
 class sqlhelper():
 
     def create_tables(self):
@@ -207,7 +259,10 @@ class sqlhelper():
                                     Server_Stats,
                                     Host_Stats,
                                     Event_Webhooks,
-                                    Command_Webhooks]
+                                    Command_Webhooks,
+                                    Server_Startups,
+                                    History_5min,
+                                    History_Hourly]
                                    )
 
     def default_settings(self, admin_pass, admin_token):
@@ -317,7 +372,100 @@ class sqlhelper():
                 Crafty_settings.language: "en_EN"
             }).where(Crafty_settings.id == 1).execute()
 
-def get_perms_for_user(user):
+        # how long a server gets to stop on its own before we terminate it
+        mc_settings_columns = [c.name for c in database.get_columns("mc_settings")]
+
+        if "stop_timeout" not in mc_settings_columns:
+            migrate(
+                migrator.add_column('mc_settings', 'stop_timeout', IntegerField(default=60))
+            )
+
+        # stats are upserted on server_id, so there can only be one row per server
+        stats_indexes = [i.name for i in database.get_indexes("stats")]
+
+        if "stats_server_id" not in stats_indexes:
+            with database.atomic():
+                # older versions could leave more than one row per server - keep the newest
+                database.execute_sql("DELETE FROM stats WHERE id NOT IN (SELECT MAX(id) FROM stats GROUP BY server_id)")
+
+                migrate(
+                    migrator.add_index('stats', ('server_id',), True)
+                )
+
+        # history is read per server over a time range, and pruned by time
+        history_indexes = [i.name for i in database.get_indexes("history")]
+
+        if "history_server_id_time" not in history_indexes:
+            migrate(
+                migrator.add_index('history', ('server_id', 'time'), False)
+            )
+
+        if "history_time" not in history_indexes:
+            migrate(
+                migrator.add_index('history', ('time',), False)
+            )
+
+        # how long to keep each history rollup tier
+        crafty_settings_columns = [c.name for c in database.get_columns("crafty_settings")]
+
+        if "history_5min_max_age" not in crafty_settings_columns:
+            migrate(
+                migrator.add_column('crafty_settings', 'history_5min_max_age', IntegerField(default=30))
+            )
+
+        if "history_hourly_max_age" not in crafty_settings_columns:
+            migrate(
+                migrator.add_column('crafty_settings', 'history_hourly_max_age', IntegerField(default=365))
+            )
+
+class PermissionCache:
+    """
+    Resolved permissions per username, so an authenticated request doesn't query Users and Roles
+
+    Entries are frozen (read only mappings) and tagged with the version they were built at.
+    Anything that edits users or roles calls bump(), which makes every cached entry stale at once
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+
+        # username -> (version, permissions)
+        self.entries = {}
+
+    def bump(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+        logger.debug("Permission cache version is now %s", self.version)
+
+    def get(self, username):
+        """
+        Args:
+            username (string): the user
+
+        Returns:
+            mappingproxy: the user's permissions, as get_perms_for_user() returns them
+        """
+        with self.lock:
+            version = self.version
+            cached = self.entries.get(username)
+
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        user_data = MappingProxyType(load_perms_for_user(username))
+
+        with self.lock:
+            # only keep it if nothing was edited while we were reading
+            if self.version == version:
+                self.entries[username] = (version, user_data)
+
+        return user_data
+
+
+def load_perms_for_user(user):
     user_data = {}
     user = model_to_dict(Users.get(Users.username == user))
     if user:
@@ -337,6 +485,11 @@ def get_perms_for_user(user):
     return user_data
 
 
+def get_perms_for_user(user):
+    # read only - cached and shared between requests
+    return permission_cache.get(user)
+
+
 def check_role_permission(username, section):
     user_data = get_perms_for_user(username)
 
@@ -353,3 +506,4 @@ def check_role_permission(username, section):
 
 
 peewee = sqlhelper()
+permission_cache = PermissionCache()
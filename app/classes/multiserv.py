@@ -3,21 +3,113 @@ import logging
 import psutil
 import datetime
 import schedule
+import threading
+import concurrent.futures
 
+from peewee import chunked
 
-from app.classes.minecraft_server import Minecraft_Server
+
+from app.classes.minecraft_server import Minecraft_Server, TERMINATE_TIMEOUT
 from app.classes.models import *
 from app.classes.helpers import helper
 from app.classes.console import console
+from app.classes.event_bus import event_bus
+from app.classes.metrics import host_metrics, CPU_COUNT
+from app.classes.fs_watcher import fs_watcher
+from app.classes.historymgr import historymgr, ROLLUP_INTERVAL
+from app.classes.command_queue import command_queue
+from app.classes.fleet_snapshot import FleetSnapshot
 
 logger = logging.getLogger(__name__)
 
+# how long stop_all_servers gives every server to stop on its own
+STOP_ALL_TIMEOUT = 60
+
+# how many servers we collect stats for at once, and how long one server gets (from when a worker picks it up)
+# before it counts as timed out - a worker can't be interrupted, so that server is left alone until it finishes
+STATS_WORKERS = 4
+STATS_SERVER_TIMEOUT = 30
+
+# how long one run waits for results - under the 10 second schedule, so the scheduler thread is never held up.
+# Anything that finishes later is written by the next run
+STATS_TICK_BUDGET = 8
+
 
 class multi_serve():
 
     def __init__(self):
         self.servers_list = {}
 
+        # server id -> the same entry as in servers_list, so a lookup by id is a plain dictionary hit
+        self.servers_by_id = {}
+
+        # server id -> its MC_settings row, loaded once and dropped by invalidate_server_data() when the config is saved
+        self.server_settings = {}
+        self.registry_lock = threading.Lock()
+
+        # stats are gathered on a small pool, so one slow server can't hold up the rest
+        self.stats_pool = concurrent.futures.ThreadPoolExecutor(max_workers=STATS_WORKERS,
+                                                                thread_name_prefix="stats")
+
+        # server id -> future, for collections that haven't been written yet (this run's, or late ones from an earlier run)
+        self.stats_in_flight = {}
+
+        # server id -> monotonic time a worker started collecting it, set by collect_server_stats()
+        self.stats_started = {}
+        self.stats_lock = threading.Lock()
+
+        # server id -> the numbers from the last successful stats run for that server, for /metrics
+        self.stats_snapshot = {}
+
+        # the numbers from the last do_host_status run
+        self.host_snapshot = {}
+
+        # how the last do_stats_for_servers run went
+        self.stats_tick = {
+            'time': None,
+            'duration': 0,
+            'servers': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'skipped': 0
+        }
+
+        # server id -> the latest stats row for that server, loaded from the stats table the first time it's needed
+        self.stats_rows = None
+
+        # what the web pages show about every server - rebuilt by refresh_fleet_snapshot(), never changed in place
+        self.fleet_snapshot = FleetSnapshot()
+        self.fleet_lock = threading.RLock()
+
+        # keep the stats table in step with server lifecycle changes, without waiting for the next stats run
+        event_bus.subscribe("server_state_changed", self.on_server_state_changed)
+
+    def on_server_state_changed(self, server_id, server_name, old_state, new_state):
+        srv_obj = self.get_server_obj(server_id)
+
+        if srv_obj is None:
+            return
+
+        if srv_obj.check_running():
+            start_time = srv_obj.start_time
+        else:
+            start_time = "Not Started"
+
+        Server_Stats.update({
+            Server_Stats.server_running: srv_obj.check_running(),
+            Server_Stats.server_start_time: start_time
+        }).where(Server_Stats.server_id == int(server_id)).execute()
+
+        with self.fleet_lock:
+            stats_rows = self.get_stats_rows()
+            row = stats_rows.get(int(server_id))
+
+            if row is not None:
+                stats_rows[int(server_id)] = dict(row, server_running=srv_obj.check_running(),
+                                                  server_start_time=start_time)
+
+            self.refresh_fleet_snapshot()
+
     def get_auto_start_servers_by_rank(self, priority):
         # priority is 1 = high, 2 = medium, 3 = low
         # this returns a list of servers who are setup for auto start, ordered by delay
@@ -84,7 +176,7 @@ class multi_serve():
             srv_obj = self.get_server_obj(s['id'])
 
             # reload the server settings
-            srv_obj.reload_settings()
+            srv_obj.reload_settings(self.get_server_data(s['id']))
 
             # echo it's now setup to the log
             logger.info("Loading settings for server %s", s['name'])
@@ -111,6 +203,33 @@ class multi_serve():
             svr_obj = multi.get_server_obj(task.server_id)
             helper.scheduler(task, svr_obj)
 
+    def sample_server_metrics(self):
+        now = time.time()
+
+        for s in list(self.servers_list.values()):
+            srv_obj = s['server_obj']
+
+            if not srv_obj.check_running():
+                continue
+
+            try:
+                srv_obj.sample_metrics(now)
+            except Exception:
+                logger.exception("Unable to sample metrics for server %s. Traceback:", s['server_id'])
+
+    def run_metrics_sampler(self):
+        # its own thread, the scheduler can be busy for seconds at a time with the stats run
+        while True:
+            self.sample_server_metrics()
+
+            # wake up on the next whole second
+            time.sleep(1 - time.time() % 1)
+
+    def start_metrics_sampler(self):
+        sampler = threading.Thread(target=self.run_metrics_sampler, daemon=True, name="metrics_sampler")
+        sampler.start()
+        return sampler
+
     def do_server_history(self):
         running = self.list_running_servers()
         for s in running:
@@ -130,27 +249,98 @@ class multi_serve():
 
         schedule.every(history_interval).minutes.do(self.do_server_history).tag('history')
 
+        # roll raw history up into the 5 minute / hourly tables and apply each tier's retention
+        schedule.every(ROLLUP_INTERVAL).minutes.do(historymgr.do_rollups).tag('history')
+
     def get_server_data(self, server_id):
-        if MC_settings.get_by_id(server_id):
-            return MC_settings.get_by_id(server_id)
-        else:
+        """
+        Returns a server's settings row, from memory when we have it
+
+        Args:
+            server_id (int): the server
+
+        Returns:
+            MC_settings: the settings, or False if there is no such server
+        """
+        server_id = int(server_id)
+
+        with self.registry_lock:
+            server_data = self.server_settings.get(server_id)
+
+        if server_data is not None:
+            return server_data
+
+        server_data = MC_settings.get_or_none(MC_settings.id == server_id)
+
+        if server_data is None:
             logger.critical("Unable to find server id %s", server_id)
             return False
 
+        with self.registry_lock:
+            self.server_settings[server_id] = server_data
+
+        return server_data
+
+    def invalidate_server_data(self, server_id=None):
+        """
+        Forgets the settings we hold for a server, so the next lookup reads them from the DB again
+
+        Args:
+            server_id (int): the server, None = every server
+        """
+        with self.registry_lock:
+            if server_id is None:
+                self.server_settings.clear()
+            else:
+                self.server_settings.pop(int(server_id), None)
+
+    def reload_server_settings(self, server_id):
+        """
+        Picks up a server's settings after they have been written to the DB
+
+        Drops the cached row, hands the fresh one to the server object and re-keys servers_list if the server was renamed
+        """
+        self.invalidate_server_data(server_id)
+        server_data = self.get_server_data(server_id)
+
+        if not server_data:
+            return False
+
+        with self.registry_lock:
+            entry = self.servers_by_id.get(int(server_id))
+
+            if entry is None:
+                logger.warning("Unable to find server object for server id %s", server_id)
+                return False
+
+            if entry['server_name'] != server_data.server_name:
+                self.servers_list.pop(entry['server_name'], None)
+                entry['server_name'] = server_data.server_name
+                self.servers_list[server_data.server_name] = entry
+
+        entry['server_obj'].reload_settings(server_data)
+        self.refresh_fleet_snapshot()
+        return True
+
     def setup_new_server_obj(self, server_id):
         server_data = self.get_server_data(server_id)
 
         if server_data.server_name not in self.servers_list.keys():
-            self.servers_list[server_data.server_name] = {
+            entry = {
                 'server_id': server_id,
                 'server_name': server_data.server_name,
                 'server_obj': Minecraft_Server()
                 }
 
+            with self.registry_lock:
+                self.servers_list[server_data.server_name] = entry
+                self.servers_by_id[int(server_id)] = entry
+
             # this kicks off the auto start for this server object
-            self.servers_list[server_data.server_name]['server_obj'].do_init_setup(server_id)
+            entry['server_obj'].do_init_setup(server_id, server_data)
+            self.refresh_fleet_snapshot()
         else:
-            logger.critical("Server %s is already defined!", server_data.name)
+            logger.critical("Server %s is already defined!", server_data.server_name)
 
     def remove_server_object(self, server_id):
 
@@ -158,15 +348,26 @@ class multi_serve():
         server_name = svr_obj.get_mc_server_name()
 
         try:
-            del self.servers_list[server_name]
+            with self.registry_lock:
+                del self.servers_list[server_name]
+                self.servers_by_id.pop(int(server_id), None)
+                self.server_settings.pop(int(server_id), None)
+
+            fs_watcher.unwatch(svr_obj.server_path.replace('"', ''))
             logger.info("Removed server \"%s\" from multi server list", server_name)
 
             # delete the server - and clean up other areas of the db
             MC_settings.delete().where(MC_settings.id == int(server_id)).execute()
             Backups.delete().where(Backups.server_id == int(server_id)).execute()
-            History.delete().where(History.server_id == int(server_id)).execute()
+            historymgr.delete_server_history(server_id)
             Server_Stats.delete().where(Server_Stats.server_id == int(server_id)).execute()
 
+            with self.stats_lock:
+                self.stats_snapshot = {sid: stats for sid, stats in self.stats_snapshot.items() if sid != int(server_id)}
+
+            with self.fleet_lock:
+                self.get_stats_rows().pop(int(server_id), None)
+                self.refresh_fleet_snapshot()
 
             logger.info('Deleted Server ID %s', server_id)
 
@@ -185,94 +386,132 @@ class multi_serve():
             return False
 
     def list_servers(self):
-
-        all_servers = MC_settings.select()
         server_list = []
-        if len(all_servers) > 0:
-            # for each server
-            for s in all_servers:
-                # is the server running?
-                srv_obj = self.get_server_obj(s.id)
-
-                server_list.append({
-                        'id': srv_obj.server_id,
-                        'name': srv_obj.get_mc_server_name(),
-                        'running': srv_obj.check_running(),
-                        'crashed': srv_obj.check_crashed(),
-                        'auto_start': srv_obj.settings.auto_start_server
-                    })
+
+        with self.registry_lock:
+            servers = sorted(self.servers_by_id.items())
+
+        # for each server, in id order like the MC_settings table
+        for server_id, s in servers:
+            srv_obj = s['server_obj']
+
+            server_list.append({
+                    'id': srv_obj.server_id,
+                    'name': srv_obj.get_mc_server_name(),
+                    'running': srv_obj.check_running(),
+                    'crashed': srv_obj.check_crashed(),
+                    'state': srv_obj.get_state(),
+                    'auto_start': srv_obj.settings.auto_start_server
+                })
 
         return server_list
 
     def get_server_obj(self, server_id):
-        server_data = self.get_server_data(server_id)
         try:
-            if self.servers_list[server_data.server_name]:
-                return self.servers_list[server_data.server_name]['server_obj']
+            entry = self.servers_by_id.get(int(server_id))
+            if entry:
+                return entry['server_obj']
             else:
                 logger.warning("Unable to find server object for server id %s", server_id)
         except:
             logger.exception("Exception occured when finding server id %s", server_id)
 
     def run_server(self, server_id):
-        Remote.insert({
-            Remote.command: 'start_mc_server',
-            Remote.server_id: server_id,
-            Remote.command_source: 'local'
-        }).execute()
+        command_queue.put('start_mc_server', server_id, 'local')
 
     def stop_server(self, server_id):
-        Remote.insert({
-            Remote.command: 'stop_mc_server',
-            Remote.server_id: server_id,
-            Remote.command_source: 'local'
-        }).execute()
+        command_queue.put('stop_mc_server', server_id, 'local')
+
+    def stop_all_servers(self, timeout=STOP_ALL_TIMEOUT, terminate_timeout=TERMINATE_TIMEOUT):
+        """
+        Stops every running server at the same time
+
+        All servers are asked to stop at once, then we wait for all of them under one shared deadline.
+        Anything still running after that gets SIGTERM, and anything still running after terminate_timeout
+        more seconds gets SIGKILL
+
+        Args:
+            timeout (int): seconds all servers get to stop gracefully
+            terminate_timeout (int): seconds all servers get to exit after SIGTERM
+        """
+        servers = []
+
+        # crashed servers waiting to restart would otherwise come back up while everything else stops -
+        # this runs first, so one that has just started restarting is picked up as running below
+        for s in list(self.servers_list.values()):
+            s['server_obj'].cancel_restart()
+
+        for s in iter(self.servers_list.values()):
+            if s['server_obj'].check_running():
+                servers.append(s['server_obj'])
 
-    def stop_all_servers(self):
-        servers = self.list_running_servers()
         logger.info("Found %s running server(s)", len(servers))
         logger.info("Stopping All Servers")
 
-        for s in servers:
-            logger.info("Stopping Server ID %s (%s)", s['id'], s['name'])
-            console.info("Stopping Server ID {} ({})".format(s['id'], s['name']))
+        started = time.monotonic()
+
+        # ask everyone at once
+        for svr_obj in servers:
+            logger.info("Stopping Server ID %s (%s)", svr_obj.server_id, svr_obj.name)
+            console.info("Stopping Server ID {} ({})".format(svr_obj.server_id, svr_obj.name))
+            svr_obj.request_stop()
+
+        # each server is exiting on its own, so waiting on them in turn against the same deadline
+        # takes no longer than the slowest one
+        remaining = self._wait_for_servers(servers, started + timeout)
+
+        # these had to be terminated (or killed), the mc_stop webhook says so
+        forced = list(remaining)
+
+        if remaining:
+            for svr_obj in remaining:
+                logger.warning("Server %s didn't stop within %s seconds", svr_obj.name, timeout)
+                console.warning("Server {} didn't stop within {} seconds - terminating it".format(svr_obj.name, timeout))
+                svr_obj.terminate_process()
+
+            remaining = self._wait_for_servers(remaining, time.monotonic() + terminate_timeout)
+
+        for svr_obj in remaining:
+            logger.critical("Server %s ignored SIGTERM - killing it", svr_obj.name)
+            svr_obj.kill_process()
+
+        self._wait_for_servers(remaining, time.monotonic() + terminate_timeout)
 
-            # get object
-            svr_obj = self.get_server_obj(s['id'])
-            running = svr_obj.check_running()
+        for svr_obj in servers:
+            # when the exit watcher saw it go - if it hasn't got there yet, the process has only just exited
+            stop_seconds = round(max((svr_obj.exit_time or time.monotonic()) - started, 0), 3)
 
-            # issue the stop command
-            self.stop_server(s['id'])
+            svr_obj.cleanup_server_object()
+            svr_obj.send_stop_webhook(stop_seconds, graceful=svr_obj not in forced)
 
-            # while it's running, we wait
-            while running:
-                logger.info("Server %s is still running - waiting 2s to see if it stops", s['name'])
-                console.info("Server {} is still running - waiting 2s to see if it stops".format(s['name']))
-                running = svr_obj.check_running()
-                time.sleep(2)
+        logger.info("All Servers Stopped in %.2f seconds", time.monotonic() - started)
 
-            # let's wait 2 seconds so the remote commands get cleared and then we can do another loop
-            time.sleep(2)
+    def _wait_for_servers(self, servers, deadline):
+        # returns the servers still running at the deadline
+        remaining = []
 
-        logger.info("All Servers Stopped")
+        for svr_obj in servers:
+            if not svr_obj.wait_for_exit(max(deadline - time.monotonic(), 0)):
+                remaining.append(svr_obj)
+
+        return remaining
 
     def list_running_servers(self):
-        all_servers = MC_settings.select()
         running_servers = []
 
-        if len(all_servers) > 0:
-            # for each server
-            for s in all_servers:
-                # is the server running?
-                srv_obj = multi.get_server_obj(s.id)
-                running = srv_obj.check_running()
+        with self.registry_lock:
+            servers = sorted(self.servers_by_id.items())
+
+        # for each server
+        for server_id, s in servers:
+            srv_obj = s['server_obj']
 
-                # if so, let's add a dictonary to the list of running servers
-                if running:
-                    running_servers.append({
-                        'id': srv_obj.server_id,
-                        'name': srv_obj.get_mc_server_name()
-                    })
+            # if it's running, let's add a dictonary to the list of running servers
+            if srv_obj.check_running():
+                running_servers.append({
+                    'id': srv_obj.server_id,
+                    'name': srv_obj.get_mc_server_name()
+                })
 
         return running_servers
 
@@ -282,55 +521,181 @@ class multi_serve():
 
     def do_stats_for_servers(self):
         if len(self.servers_list) > 0:
-
-            # for each server defined
-            for s in iter(self.servers_list.items()):
-
-                # get the server object
-                srv_obj = s[1]['server_obj']
-
-                # get the stats from the object
-                stats = srv_obj.get_mc_process_stats()
-
-                # delete the old history stats for this server
-                # Server_Stats.delete().where(Server_Stats.server_id == int(s[1]['server_id'])).execute()
-
-                exists = Server_Stats.select().where(Server_Stats.server_id == int(s[1]['server_id'])).exists()
-
-                if exists:
-                    Server_Stats.update({
-                        Server_Stats.server_id: s[1]['server_id'],
-                        Server_Stats.server_start_time: stats['server_start_time'],
-                        Server_Stats.server_running: stats['server_running'],
-                        Server_Stats.cpu_usage: stats['cpu_usage'],
-                        Server_Stats.memory_usage: stats['memory_usage'],
-                        Server_Stats.world_name: stats['world_name'],
-                        Server_Stats.world_size: stats['world_size'],
-                        Server_Stats.online_players: stats['online'],
-                        Server_Stats.max_players: stats['max'],
-                        Server_Stats.players: stats['players'],
-                        Server_Stats.motd: stats['server_description'],
-                        Server_Stats.server_version: stats['server_version'],
-                        Server_Stats.server_ip: stats['server_ip'],
-                        Server_Stats.server_port: stats['server_port'],
-                    }).where(Server_Stats.server_id == int(s[1]['server_id'])).execute()
-                else:
-                    Server_Stats.insert({
-                        Server_Stats.server_id: s[1]['server_id'],
-                        Server_Stats.server_start_time: stats['server_start_time'],
-                        Server_Stats.server_running: stats['server_running'],
-                        Server_Stats.cpu_usage: stats['cpu_usage'],
-                        Server_Stats.memory_usage: stats['memory_usage'],
-                        Server_Stats.world_name: stats['world_name'],
-                        Server_Stats.world_size: stats['world_size'],
-                        Server_Stats.online_players: stats['online'],
-                        Server_Stats.max_players: stats['max'],
-                        Server_Stats.players: stats['players'],
-                        Server_Stats.motd: stats['server_description'],
-                        Server_Stats.server_version: stats['server_version'],
-                        Server_Stats.server_ip: stats['server_ip'],
-                        Server_Stats.server_port: stats['server_port'],
-                    }).execute()
+            tick_start = time.monotonic()
+            submitted = []
+            skipped = 0
+            timed_out = 0
+
+            with self.registry_lock:
+                servers = list(self.servers_by_id.items())
+
+            # for each server defined - start collecting its stats on the pool
+            with self.stats_lock:
+                for server_id, entry in servers:
+                    previous = self.stats_in_flight.get(server_id)
+
+                    # late results from an earlier run are picked up below, with this run's
+                    if previous is not None:
+                        if previous.done():
+                            continue
+
+                        # still busy from an earlier run, don't pile another one on top of it
+                        started = self.stats_started.get(server_id)
+
+                        if started is not None and tick_start - started > STATS_SERVER_TIMEOUT:
+                            logger.warning("Timed out getting stats for server %s", server_id)
+                            timed_out += 1
+                        else:
+                            logger.warning("Stats for server %s are still running from the last run, skipping", server_id)
+                            skipped += 1
+                        continue
+
+                    future = self.stats_pool.submit(self.collect_server_stats, server_id, entry['server_obj'])
+                    self.stats_in_flight[server_id] = future
+                    submitted.append(future)
+
+            # give this run's collections a little time - whatever isn't done by then waits for the next run
+            concurrent.futures.wait(submitted, timeout=max(STATS_TICK_BUDGET - (time.monotonic() - tick_start), 0))
+
+            results, failed = self.take_server_stats()
+            rows = [self.build_server_stats_row(server_id, stats) for server_id, stats in results.items()]
+
+            try:
+                self.write_server_stats(rows)
+            except Exception:
+                logger.exception("Unable to save stats for %s server(s). Traceback:", len(rows))
+                failed += len(rows)
+
+            # swapped in whole, so readers never see a half updated snapshot - and a server removed
+            # while we were collecting doesn't come back
+            with self.stats_lock:
+                snapshot = dict(self.stats_snapshot)
+                snapshot.update((server_id, stats) for server_id, stats in results.items()
+                                if server_id in self.servers_by_id)
+                self.stats_snapshot = snapshot
+
+            with self.fleet_lock:
+                stats_rows = self.get_stats_rows()
+
+                # anything we don't set (the row id) is kept from the last row
+                for row in rows:
+                    server_id = row[Server_Stats.server_id]
+
+                    # the same values model_to_dict() gives for a row read back from the table - players is
+                    # a list here but a CharField there, and the pages expect the stored string
+                    fields = {field.name: field.python_value(field.db_value(value)) for field, value in row.items()}
+                    stats_rows[server_id] = dict(stats_rows.get(server_id, {}), **fields)
+
+                self.refresh_fleet_snapshot()
+
+            duration = round(time.monotonic() - tick_start, 3)
+
+            self.stats_tick = {
+                'time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'duration': duration,
+                'servers': len(results),
+                'failed': failed,
+                'timed_out': timed_out,
+                'skipped': skipped
+            }
+
+            logger.debug("Stats run for %s server(s) took %s seconds", len(results), duration)
+
+    def collect_server_stats(self, server_id, srv_obj):
+        # runs on the stats pool - the timeout for this server counts from here, not from when it was queued
+        self.stats_started[server_id] = time.monotonic()
+        return srv_obj.get_mc_process_stats()
+
+    def take_server_stats(self):
+        """
+        Takes every finished collection out of stats_in_flight
+
+        Returns:
+            tuple: (server id -> stats for servers that are still defined, how many collections failed)
+        """
+        results = {}
+        failed = 0
+
+        with self.stats_lock:
+            done = [(server_id, future) for server_id, future in self.stats_in_flight.items() if future.done()]
+
+            for server_id, future in done:
+                del self.stats_in_flight[server_id]
+                self.stats_started.pop(server_id, None)
+
+        for server_id, future in done:
+            try:
+                stats = future.result()
+            except Exception:
+                logger.exception("Unable to get stats for server %s. Traceback:", server_id)
+                failed += 1
+                continue
+
+            # removed while we were collecting - don't bring its stats back
+            if server_id in self.servers_by_id:
+                results[int(server_id)] = stats
+
+        return results, failed
+
+    def build_server_stats_row(self, server_id, stats):
+        """
+        Turns what Minecraft_Server.get_mc_process_stats() returned into a Server_Stats row
+
+        Args:
+            server_id (int): the server the stats belong to
+            stats (dict): the collected stats
+
+        Returns:
+            dict: field -> value, ready for write_server_stats()
+        """
+        return {
+            Server_Stats.server_id: int(server_id),
+            Server_Stats.time: datetime.datetime.now(),
+            Server_Stats.server_start_time: stats['server_start_time'],
+            Server_Stats.server_running: stats['server_running'],
+            Server_Stats.cpu_usage: stats['cpu_usage'],
+            Server_Stats.memory_usage: stats['memory_usage'],
+            Server_Stats.world_name: stats['world_name'],
+            Server_Stats.world_size: stats['world_size'],
+            Server_Stats.online_players: stats['online'],
+            Server_Stats.max_players: stats['max'],
+            Server_Stats.players: stats['players'],
+            Server_Stats.motd: stats['server_description'],
+            Server_Stats.server_version: stats['server_version'],
+            Server_Stats.server_ip: stats['server_ip'],
+            Server_Stats.server_port: stats['server_port'],
+        }
+
+    def write_server_stats(self, rows):
+        """
+        Saves the latest stats for many servers in one transaction
+
+        Each row replaces the existing row for its server (the unique index on stats.server_id
+        is what the upsert conflicts on), or becomes a new row for a server we haven't seen yet
+
+        Args:
+            rows (list): dicts from build_server_stats_row()
+        """
+        if not rows:
+            return
+
+        # everything except the key gets overwritten on conflict
+        preserve = [field for field in rows[0].keys() if field is not Server_Stats.server_id]
+
+        with database.atomic():
+            # stay well under SQLite's limit on variables per statement
+            for batch in chunked(rows, 50):
+                Server_Stats.insert_many(batch).on_conflict(
+                    conflict_target=[Server_Stats.server_id],
+                    preserve=preserve
+                ).execute()
+
+    def get_stats_tick(self):
+        return dict(self.stats_tick)
+
+    def get_stats_snapshot(self):
+        # copies, so a caller can't change what the next reader sees
+        return {server_id: dict(stats) for server_id, stats in self.stats_snapshot.items()}
 
     def get_stats_for_server(self, server_id):
         q = Server_Stats.select().where(Server_Stats.server_id == int(server_id))
@@ -342,48 +707,96 @@ class multi_serve():
             return False
 
     def get_stats_for_servers(self):
+        """
+        Returns:
+            dict: server id -> stats row plus the server name, copied from the fleet snapshot so callers can change them
+        """
+        return {server_id: dict(stats) for server_id, stats in self.fleet_snapshot.mc_servers_data.items()}
 
-        all_servers_return = {}
+    def get_stats_rows(self):
+        # only read the stats table once, after that the stats run and lifecycle events keep these up to date
+        with self.fleet_lock:
+            if self.stats_rows is None:
+                self.stats_rows = {}
 
-        if len(self.servers_list) > 0:
+                for server_stats in Server_Stats.select():
+                    self.stats_rows[int(server_stats.server_id)] = model_to_dict(server_stats)
+
+            return self.stats_rows
 
-            # for each server defined
-            for s in iter(self.servers_list.items()):
-                    server_id = s[1]['server_id']
-                    q = Server_Stats.select().where(Server_Stats.server_id == int(server_id))
+    def refresh_fleet_snapshot(self):
+        """
+        Builds a new FleetSnapshot from the server objects and the latest stats rows, and swaps it in
 
-                    if q.exists():
-                        server_stats = Server_Stats.get(Server_Stats.server_id == int(server_id))
-                        stats = model_to_dict(server_stats)
+        Called after each stats run and on server lifecycle changes, so handlers never build this themselves
+        """
+        with self.fleet_lock:
+            stats_rows = self.get_stats_rows()
+            servers_defined = self.list_servers()
+            servers_running = []
+            mc_servers_data = {}
 
-                        # let's get the server object - and ask it's name
-                        srv_obj = self.get_server_obj(server_id)
-                        stats['name'] = srv_obj.get_mc_server_name(server_id)
+            for s in servers_defined:
+                if s['running']:
+                    servers_running.append({'id': s['id'], 'name': s['name']})
 
-                        # all_servers_return.update({server_id: model_to_dict(server_stats)})
-                        all_servers_return.update({server_id: stats})
-        return all_servers_return
+                row = stats_rows.get(int(s['id']))
+
+                if row is not None:
+                    mc_servers_data[int(s['id'])] = dict(row, name=s['name'])
+
+            self.fleet_snapshot = FleetSnapshot(servers_defined, servers_running, mc_servers_data)
+
+        return self.fleet_snapshot
+
+    def get_fleet_snapshot(self):
+        return self.fleet_snapshot
 
     def do_host_status(self):
-        boot_time = datetime.datetime.fromtimestamp(psutil.boot_time())
+        boot_timestamp = psutil.boot_time()
+        boot_time = datetime.datetime.fromtimestamp(boot_timestamp)
+        cpu_freq = psutil.cpu_freq()
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+
+        self.host_snapshot = {
+            'boot_time': boot_timestamp,
+            # psutil already averages this over all cores
+            'cpu_usage': host_metrics.sample_cpu(),
+            'cpu_cores': CPU_COUNT,
+            'cpu_cur_freq': round(cpu_freq[0], 2),
+            'cpu_max_freq': cpu_freq[2],
+            'mem_percent': memory[2],
+            'mem_used': memory[3],
+            'mem_total': memory[0],
+            'disk_percent': disk[3],
+            'disk_used': disk[1],
+            'disk_total': disk[0],
+        }
+
+        host = self.host_snapshot
 
         insert_id = Host_Stats.insert({
             Host_Stats.boot_time: str(boot_time),
-            Host_Stats.cpu_usage: round(psutil.cpu_percent(interval=0.5) / psutil.cpu_count(), 2),
-            Host_Stats.cpu_cores: psutil.cpu_count(),
-            Host_Stats.cpu_cur_freq: round(psutil.cpu_freq()[0], 2),
-            Host_Stats.cpu_max_freq: psutil.cpu_freq()[2],
-            Host_Stats.mem_percent: psutil.virtual_memory()[2],
-            Host_Stats.mem_usage: helper.human_readable_file_size(psutil.virtual_memory()[3]),
-            Host_Stats.mem_total: helper.human_readable_file_size(psutil.virtual_memory()[0]),
-            Host_Stats.disk_percent: psutil.disk_usage('/')[3],
-            Host_Stats.disk_usage: helper.human_readable_file_size(psutil.disk_usage('/')[1]),
-            Host_Stats.disk_total: helper.human_readable_file_size(psutil.disk_usage('/')[0]),
+            # the dashboard has always shown this column divided by the core count, keep it that way
+            Host_Stats.cpu_usage: round(host['cpu_usage'] / CPU_COUNT, 2),
+            Host_Stats.cpu_cores: host['cpu_cores'],
+            Host_Stats.cpu_cur_freq: host['cpu_cur_freq'],
+            Host_Stats.cpu_max_freq: host['cpu_max_freq'],
+            Host_Stats.mem_percent: host['mem_percent'],
+            Host_Stats.mem_usage: helper.human_readable_file_size(host['mem_used']),
+            Host_Stats.mem_total: helper.human_readable_file_size(host['mem_total']),
+            Host_Stats.disk_percent: host['disk_percent'],
+            Host_Stats.disk_usage: helper.human_readable_file_size(host['disk_used']),
+            Host_Stats.disk_total: helper.human_readable_file_size(host['disk_total']),
         }).execute()
 
         # make sure we only have 1 record/row
         Host_Stats.delete().where(Host_Stats.id < int(insert_id)).execute()
 
+    def get_host_snapshot(self):
+        return dict(self.host_snapshot)
+
     def get_host_status(self):
         q = Host_Stats.get()
         data = model_to_dict(q)
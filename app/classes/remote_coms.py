@@ -1,15 +1,24 @@
 import os
 import time
 import logging
+import threading
+import concurrent.futures
 
-from app.classes.models import Remote, model_to_dict, MC_settings
+from app.classes.models import Remote, model_to_dict
 from app.classes.ftp import ftp_svr_object
 from app.classes.multiserv import multi
 from app.classes.helpers import helper
 from app.classes.webhookmgr import webhookmgr
+from app.classes.command_queue import command_queue
 
 logger = logging.getLogger(__name__)
 
+# how often we look in the Remote table for commands from other processes (crafty.py -k)
+JOURNAL_INTERVAL = 1
+
+# commands for Crafty itself (or its one FTP server) rather than a Minecraft server - these run one at a time on their own worker
+CRAFTY_COMMANDS = ("restart_web_server", "reload_mc_settings", "exit_crafty", "start_ftp", "stop_ftp")
+
 # Had to define like this otherwise i would cause a circular import
 commands = {
     "restart_web_server": "Restart Web Server",
@@ -28,6 +37,12 @@ class remote_commands():
         self.tornado_obj = tornado_obj
         self.clear_all_commands()
 
+        # one worker per server, so a slow stop on one server doesn't hold up the others,
+        # while commands for the same server still run in the order they were sent
+        self.server_executors = {}
+        self.executors_lock = threading.Lock()
+        self.crafty_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="commands_crafty")
+
     def clear_all_commands(self):
         logger.info("Clearing all Remote Commands")
         Remote.delete().execute()
@@ -35,27 +50,65 @@ class remote_commands():
     def start_watcher(self):
         logger.info("Starting Remote Command Processor Daemon")
         self.keep_processing = True
+
+        journal_thread = threading.Thread(target=self.watch_journal, daemon=True, name="Remote_Coms_Journal")
+        journal_thread.start()
+
         self.watch_for_commands()
 
+    def watch_journal(self):
+        # other processes can't reach our queue, so they leave commands in the Remote table for us
+        while True:
+            try:
+                for entry in Remote.select().order_by(Remote.id):
+                    command_queue.put(entry.command, entry.server_id, entry.command_source)
+
+                    # deleting the row is how the sender knows we have it
+                    Remote.delete_by_id(entry.id)
+            except Exception:
+                logger.exception("Unable to read the Remote command journal. Traceback:")
+
+            time.sleep(JOURNAL_INTERVAL)
+
     def watch_for_commands(self):
         while True:
-            command_instance = Remote.select().where(Remote.id == 1).exists()
-            if command_instance:
-                entry = Remote.get_by_id(1)
-                command_data = model_to_dict(entry)
-                command = command_data['command']
-                server_id = command_data['server_id']
-                source = command_data['command_source']
+            # wakes up as soon as a command is queued
+            command_data = command_queue.get()
+            command = command_data['command']
+            server_id = command_data['server_id']
+            source = command_data['command_source']
 
-                server_data = MC_settings.get_by_id(server_id)
-                server_name = server_data.server_name
+            server_data = multi.get_server_data(server_id)
+            server_name = server_data.server_name if server_data else server_id
 
-                logger.info("Remote Command \"%s\" found for server \"%s\" from source %s. Executing!", command, server_name, source)
+            logger.info("Remote Command \"%s\" found for server \"%s\" from source %s. Executing!", command, server_name, source)
 
-                self.handle_command(command, server_id)
-                self.clear_all_commands()
+            self.get_executor(command, server_id).submit(self.run_command, command, server_id, server_name)
 
-            time.sleep(1)
+    def get_executor(self, command, server_id):
+        if command in CRAFTY_COMMANDS:
+            return self.crafty_executor
+
+        try:
+            server_id = int(server_id)
+        except (TypeError, ValueError):
+            pass
+
+        with self.executors_lock:
+            executor = self.server_executors.get(server_id)
+
+            if executor is None:
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                 thread_name_prefix="commands_server_{}".format(server_id))
+                self.server_executors[server_id] = executor
+
+        return executor
+
+    def run_command(self, command, server_id, server_name):
+        try:
+            self.handle_command(command, server_id)
+        except Exception:
+            logger.exception("Remote Command \"%s\" for server \"%s\" failed. Traceback:", command, server_name)
 
     def list_commands(self):
         # just a quick helper to list commands. will improve in future
@@ -90,11 +143,11 @@ class remote_commands():
             time.sleep(1)
             self.tornado_obj.start_web_server(True)
             webhookmgr.run_command_webhooks(command, webhookmgr.payload_formatter(200, {}, {"code": "WEBSRV_RESTART"}, {"info": "Crafty Web Interface action has completed"}))
-            self.clear_all_commands()
 
         elif command == "reload_mc_settings":
-            any_srv_obj = multi.get_first_server_object()
-            any_srv_obj.reload_settings()
+            # through multi, so its cached settings and the fleet snapshot are reloaded with the server objects
+            for server_id in list(multi.servers_by_id):
+                multi.reload_server_settings(server_id)
 
         elif command == 'restart_mc_server':
             if running:
@@ -126,16 +179,12 @@ class remote_commands():
 
         elif command == 'start_mc_server':
             srv_obj.run_threaded_server()
-            time.sleep(2)
-            multi.do_stats_for_servers()
             webhookmgr.run_command_webhooks(command, webhookmgr.payload_formatter(200, {}, {"code": "SER_START_DONE", "server": {"id": server_id, "name": server_name, "running": running}}, {"info": "Server start action has completed"}))
 
         elif command == 'stop_mc_server':
             if running:
                 logger.info("Stopping MC server %s", server_name)
                 srv_obj.stop_threaded_server()
-                time.sleep(2)
-                multi.do_stats_for_servers()
                 webhookmgr.run_command_webhooks(command, webhookmgr.payload_formatter(200, {}, {"code": "SER_STOP_DONE", "server": {"id": server_id, "name": server_name, "running": running}}, {"info": "Server stop action has completed"}))
             else:
                 logger.info("Stop halted! Server %s is not running!", server_name)
@@ -168,7 +217,7 @@ class remote_commands():
             os._exit(0)
 
         elif command == 'start_ftp':
-            settings = MC_settings.get_by_id(server_id)
+            settings = multi.get_server_data(server_id)
 
             if ftp_svr_object.check_running():
                 logger.warning("The FTP server is already running - please stop it before starting again")
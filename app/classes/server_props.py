@@ -1,42 +1,80 @@
-import pprint
 import os
+import pprint
+import logging
+import threading
+
+from app.classes.fs_watcher import fs_watcher
+
+logger = logging.getLogger(__name__)
+
 
 class ServerProps:
 
     def __init__(self, filepath):
         self.filepath = filepath
+
+        # comment lines from the top of the file, written back out as-is by save()
+        self.header = []
         self.props = self._parse()
 
     def _parse(self):
         """Loads and parses the file speified in self.filepath"""
+        d = {}
         with open(self.filepath) as fp:
-            line = fp.readline()
-            d = {}
-            if os.path.exists(".header"):
-                os.remove(".header")
-            while line:
-                if '#' != line[0]:
-                    s = line
-                    s1 = s[:s.find('=')]
-                    if '\n' in s:
-                        s2 = s[s.find('=')+1:s.find('\\')]
-                    else:
-                        s2 = s[s.find('=')+1:]
-                    d[s1] = s2
-                else:
-                    with open(".header", "a+") as h:
-                        h.write(line)
-                line = fp.readline()
+            for line in fp:
+                line = line.rstrip('\r\n')
+
+                if not line.strip():
+                    continue
+
+                if line.lstrip().startswith('#'):
+                    self.header.append(line)
+                    continue
+
+                key, sep, value = line.partition('=')
+                d[key.strip()] = value
         return d
 
     def print(self):
         """Prints the properties dictionary (using pprint)"""
         pprint.pprint(self.props)
-        
+
     def get(self):
         """Returns the properties dictionary"""
         return self.props
 
+    def get_str(self, key, default=None):
+        """Returns a property as a string, or default if it isn't set"""
+        return self.props.get(key, default)
+
+    def get_int(self, key, default=None):
+        """Returns a property as an int, or default if it isn't set or isn't a number"""
+        try:
+            return int(self.props[key])
+        except (KeyError, ValueError):
+            return default
+
+    def get_bool(self, key, default=None):
+        """Returns a property as a bool, or default if it isn't set or isn't true/false"""
+        value = self.props.get(key, '').strip().lower()
+        if value == 'true':
+            return True
+        elif value == 'false':
+            return False
+        return default
+
+    @property
+    def level_name(self):
+        return self.get_str('level-name', 'world')
+
+    @property
+    def server_port(self):
+        return self.get_int('server-port', 25565)
+
+    @property
+    def view_distance(self):
+        return self.get_int('view-distance', 10)
+
     def update(self, key, val):
         """Updates property in the properties dictionary [ update("pvp", "true") ] and returns boolean condition"""
         if key in self.props.keys():
@@ -47,16 +85,64 @@ class ServerProps:
 
     def save(self):
         """Writes to the new file"""
-        with open(self.filepath, "a+") as f:
-            f.truncate(0)
-            with open(".header") as header:
-                line = header.readline()
-                while line:
-                    f.write(line)
-                    line = header.readline()
-                header.close()
+        with open(self.filepath, "w") as f:
+            for line in self.header:
+                f.write(line + "\n")
             for key, value in self.props.items():
                 f.write(key + "=" + value + "\n")
-        if os.path.exists(".header"):
-                os.remove(".header")
-            
+
+
+class ServerPropsCache:
+    """
+    Hands out parsed properties files, only parsing a file again when its mtime or size changes
+
+    The stat comes from fs_watcher, so for a watched server directory a read that finds nothing
+    changed never touches the disk. The objects returned are shared - to change a file, build your
+    own ServerProps(), update() it and save()
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # file path -> ((mtime, size), ServerProps)
+        self.files = {}
+
+    def get(self, filepath):
+        """
+        Args:
+            filepath (string): the properties file
+
+        Returns:
+            ServerProps: the parsed file, or None if it doesn't exist or can't be read
+        """
+        filepath = os.path.normpath(filepath)
+        stat = fs_watcher.stat(filepath)
+
+        if not stat or stat['is_dir']:
+            with self.lock:
+                self.files.pop(filepath, None)
+            return None
+
+        signature = (stat['mtime'], stat['size'])
+
+        with self.lock:
+            cached = self.files.get(filepath)
+
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+        try:
+            props = ServerProps(filepath)
+        except (OSError, UnicodeDecodeError):
+            logger.warning("Unable to read properties file %s", filepath)
+            return None
+
+        logger.debug("Parsed properties file %s", filepath)
+
+        with self.lock:
+            self.files[filepath] = (signature, props)
+
+        return props
+
+
+server_props_cache = ServerPropsCache()
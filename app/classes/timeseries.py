@@ -0,0 +1,149 @@
+import time
+import logging
+import datetime
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# one slot per second, this many seconds back
+SERIES_SECONDS = 3600
+
+METRICS = ('cpu', 'memory', 'players')
+
+
+class TimeSeries:
+    """
+    A fixed size ring buffer holding one sample per second for a set of metrics
+
+    Each metric is a flat array('f') and there is one array of unix seconds saying when each slot was
+    last written, so the memory used never grows (about 20 bytes per second kept) and an old slot
+    is simply overwritten when the clock comes round to it again
+    """
+
+    def __init__(self, seconds=SERIES_SECONDS, metrics=METRICS):
+        self.seconds = seconds
+        self.metrics = metrics
+        self.lock = threading.Lock()
+
+        # the unix second each slot holds, 0 = never written
+        self.stamps = array('q', [0]) * seconds
+        self.values = {name: array('f', [0.0]) * seconds for name in metrics}
+
+    def record(self, stamp=None, **values):
+        """
+        Stores one sample - a second sample in the same second replaces the first
+
+        Args:
+            stamp (float): unix time of the sample, defaults to now
+            **values: metric name -> value, metrics we don't keep are ignored
+        """
+        second = int(stamp if stamp is not None else time.time())
+        slot = second % self.seconds
+
+        with self.lock:
+            self.stamps[slot] = second
+
+            for name in self.metrics:
+                self.values[name][slot] = values.get(name, 0.0) or 0.0
+
+    def get_samples(self, seconds=None, end=None):
+        """
+        Returns the samples we have for the last few seconds, oldest first
+
+        Args:
+            seconds (int): how far back to go, at most SERIES_SECONDS
+            end (float): unix time to count back from, defaults to now
+
+        Returns:
+            list: (unix second, {metric: value}) tuples, seconds with no sample are skipped
+        """
+        end = int(end if end is not None else time.time())
+        seconds = min(int(seconds or self.seconds), self.seconds)
+
+        samples = []
+
+        with self.lock:
+            for second in range(end - seconds + 1, end + 1):
+                slot = second % self.seconds
+
+                if self.stamps[slot] == second:
+                    samples.append((second, {name: self.values[name][slot] for name in self.metrics}))
+
+        return samples
+
+    def get_average(self, name, seconds, end=None):
+        """
+        Returns:
+            float: the mean of a metric over the last few seconds, or None if we have no samples
+        """
+        values = [sample[name] for second, sample in self.get_samples(seconds, end)]
+
+        if not values:
+            return None
+
+        return sum(values) / len(values)
+
+    def get_max(self, name, seconds, end=None):
+        """
+        Returns:
+            float: the highest value of a metric over the last few seconds, or None if we have no samples
+        """
+        values = [sample[name] for second, sample in self.get_samples(seconds, end)]
+
+        if not values:
+            return None
+
+        return max(values)
+
+    def get_window(self, seconds=None, max_points=None, end=None):
+        """
+        Returns the last few seconds as chart columns, averaged down to about max_points buckets
+
+        Buckets line up with the clock, so a window that starts mid bucket can give one extra point
+
+        The layout matches historymgr.get_history(), so a chart can read either one
+
+        Args:
+            seconds (int): how far back to go, at most SERIES_SECONDS
+            max_points (int): how many points the caller wants, at most
+            end (float): unix time to count back from, defaults to now
+
+        Returns:
+            dict: time (local 'YYYY-MM-DD HH:MM:SS'), cpu, mem, players, bucket_seconds and source
+        """
+        seconds = min(int(seconds or self.seconds), self.seconds)
+        bucket_seconds = 1
+
+        if max_points:
+            bucket_seconds = max(-(-seconds // int(max_points)), 1)
+
+        # bucket start -> list of samples
+        buckets = {}
+
+        for second, sample in self.get_samples(seconds, end):
+            buckets.setdefault(second - second % bucket_seconds, []).append(sample)
+
+        data = {
+            'time': [],
+            'cpu': [],
+            'mem': [],
+            'players': [],
+            'bucket_seconds': bucket_seconds,
+            'source': 'memory'
+        }
+
+        for bucket in sorted(buckets):
+            samples = buckets[bucket]
+
+            data['time'].append(datetime.datetime.fromtimestamp(bucket).strftime("%Y-%m-%d %H:%M:%S"))
+            data['cpu'].append(round(sum(s['cpu'] for s in samples) / len(samples), 2))
+            data['mem'].append(round(sum(s['memory'] for s in samples) / len(samples), 2))
+            data['players'].append(int(max(s['players'] for s in samples)))
+
+        return data
+
+    def clear(self):
+        with self.lock:
+            for slot in range(self.seconds):
+                self.stamps[slot] = 0
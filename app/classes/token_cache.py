@@ -0,0 +1,126 @@
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from app.classes.models import Users, permission_cache
+
+logger = logging.getLogger(__name__)
+
+# how many good tokens we remember, least recently used go first
+MAX_TOKENS = 128
+
+# how many bad tokens we remember, and for how long (seconds)
+MAX_BAD_TOKENS = 1024
+BAD_TOKEN_TTL = 60
+
+
+def token_key(token):
+    # entries are found by a digest of the token, so the lookup never compares the token itself
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+class ApiTokenCache:
+    """
+    Maps API tokens to usernames without a Users query on every API call
+
+    Good tokens live in a small LRU. Bad tokens get their own LRU with a short expiry, so a client
+    retrying a wrong token can't push the good ones out. Anything that adds, deletes or re-keys a
+    user bumps the permission cache version, and that empties this cache too
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # token digest -> (token, username)
+        self.tokens = OrderedDict()
+
+        # token digest -> unix time the entry stops counting
+        self.bad_tokens = OrderedDict()
+
+        # the permission_cache version our entries were built at
+        self.version = permission_cache.version
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+            self.bad_tokens.clear()
+            self.version = permission_cache.version
+
+    def _check_version(self):
+        # called with the lock held
+        if self.version != permission_cache.version:
+            self.tokens.clear()
+            self.bad_tokens.clear()
+            self.version = permission_cache.version
+
+    def authenticate(self, token):
+        """
+        Args:
+            token (string): the token the client sent
+
+        Returns:
+            string: the username the token belongs to, or None if it doesn't belong to anyone
+        """
+        if not token:
+            return None
+
+        key = token_key(token)
+
+        with self.lock:
+            self._check_version()
+            version = self.version
+
+            cached = self.tokens.get(key)
+
+            if cached is not None:
+                self.tokens.move_to_end(key)
+
+                if hmac.compare_digest(cached[0].encode('utf-8'), token.encode('utf-8')):
+                    return cached[1]
+
+            expires = self.bad_tokens.get(key)
+
+            if expires is not None:
+                if expires > time.time():
+                    return None
+
+                del self.bad_tokens[key]
+
+        username = self._lookup(token)
+
+        with self.lock:
+            # a user was changed while we were reading - don't keep what we found
+            if self.version != version or permission_cache.version != version:
+                return username
+
+            if username is None:
+                self.bad_tokens[key] = time.time() + BAD_TOKEN_TTL
+                self.bad_tokens.move_to_end(key)
+
+                while len(self.bad_tokens) > MAX_BAD_TOKENS:
+                    self.bad_tokens.popitem(last=False)
+            else:
+                self.tokens[key] = (token, username)
+                self.tokens.move_to_end(key)
+
+                while len(self.tokens) > MAX_TOKENS:
+                    self.tokens.popitem(last=False)
+
+        return username
+
+    def _lookup(self, token):
+        # api_token is a unique column, so this is an index lookup
+        user_data = Users.get_or_none(Users.api_token == token)
+
+        if user_data is None:
+            logger.warning("API authentication failed: unknown token")
+            return None
+
+        logger.info("User %s has authenticated to API", user_data.username)
+        return user_data.username
+
+
+api_token_cache = ApiTokenCache()
@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import threading
+
+from app.classes.fs_watcher import fs_watcher
+
+logger = logging.getLogger(__name__)
+
+# how often we walk the whole server tree looking for new region directories (new dimensions, new worlds)
+DISCOVERY_INTERVAL = 600
+
+# region files grow in place, which doesn't touch the directory mtime - so even an unchanged
+# region directory gets its files re-stat'd this often
+REGION_RESCAN_INTERVAL = 60
+
+
+def get_dir_size(path):
+    """
+    Adds up the size of every file under a directory
+
+    Args:
+        path (string): the directory to measure
+
+    Returns:
+        int: total size in bytes
+    """
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            total += get_dir_size(entry.path)
+        else:
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class WorldSizeIndex:
+    """
+    Keeps the size of every "region" directory under a server path, so we don't walk the whole
+    server tree every time someone asks how big the world is
+
+    The tree is only walked to find region directories every DISCOVERY_INTERVAL seconds. After that
+    a region directory is only measured again when its mtime changes (chunks added or removed),
+    when it hasn't been measured for REGION_RESCAN_INTERVAL seconds, or when it is invalidated
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root_path = None
+        self.last_discovery = 0
+
+        # region dir path -> {'mtime': dir mtime, 'size': bytes, 'scanned': monotonic time}
+        self.regions = {}
+
+    def invalidate(self, path=None):
+        """
+        Marks part of the index as stale, so the next get_size() measures it again
+
+        Args:
+            path (string): a region directory, or anything inside one. None = everything, including discovery
+        """
+        with self.lock:
+            if path is None:
+                self.last_discovery = 0
+                for entry in self.regions.values():
+                    entry['scanned'] = 0
+                return
+
+            path = os.path.normpath(path)
+
+            for region_path, entry in self.regions.items():
+                if path == region_path or path.startswith(region_path + os.sep):
+                    entry['scanned'] = 0
+                    return
+
+            # something changed that isn't in a region we know about - it could be a new one
+            self.last_discovery = 0
+
+    def discover(self, root_path):
+        region_paths = []
+
+        for root, dirs, files in os.walk(root_path):
+            if "region" in dirs:
+                # log it!
+                logger.debug("Path %s is called region. Adding it to the world size index", os.path.join(root, "region"))
+                region_paths.append(os.path.normpath(os.path.join(root, "region")))
+
+                # no need to walk inside a region directory, we measure it separately
+                dirs.remove("region")
+
+        return region_paths
+
+    def get_size(self, root_path):
+        """
+        Returns the total size of all region directories under a server path
+
+        Args:
+            root_path (string): the server path
+
+        Returns:
+            int: total size in bytes
+        """
+        # if every directory is watched, the watcher already knows all of this
+        region_paths = fs_watcher.find_dirs(root_path.replace('"', ''), "region")
+
+        if region_paths is not None:
+            return sum(fs_watcher.get_dir_size(path) for path in region_paths)
+
+        with self.lock:
+            now = time.monotonic()
+
+            if root_path != self.root_path:
+                self.root_path = root_path
+                self.regions = {}
+                self.last_discovery = 0
+
+            if now - self.last_discovery > DISCOVERY_INTERVAL:
+                found = self.discover(root_path)
+                self.regions = {path: self.regions.get(path, {'mtime': None, 'size': 0, 'scanned': 0})
+                                for path in found}
+                self.last_discovery = now
+
+            total_size = 0
+
+            for region_path, entry in list(self.regions.items()):
+                try:
+                    mtime = os.stat(region_path).st_mtime
+                except OSError:
+                    # the world was deleted or moved, we'll find it again on the next discovery
+                    del self.regions[region_path]
+                    continue
+
+                if mtime != entry['mtime'] or now - entry['scanned'] > REGION_RESCAN_INTERVAL:
+                    try:
+                        entry['size'] = get_dir_size(region_path)
+                    except OSError:
+                        logger.warning("Unable to get size of %s", region_path)
+                        continue
+
+                    entry['mtime'] = mtime
+                    entry['scanned'] = now
+
+                total_size += entry['size']
+
+            return total_size
@@ -116,15 +116,8 @@ def start_scheduler():
 
 
 def send_kill_command():
-    # load the remote commands obj
-    from app.classes.remote_coms import remote_commands
-    from app.classes.http import tornado_srv
-    from app.classes.models import peewee, Remote
-
-    # start the remote commands watcher thread
-    remote_coms = remote_commands(tornado_srv)
-    remote_coms_thread = threading.Thread(target=remote_coms.start_watcher, daemon=True, name="Remote_Coms")
-    remote_coms_thread.start()
+    # hand the exit command to the running crafty, which stops all its servers in parallel and exits
+    from app.classes.models import Remote
 
     Remote.insert({
         Remote.command: 'exit_crafty',
@@ -132,8 +125,18 @@ def send_kill_command():
         Remote.command_source: 'local'
     }).execute()
 
-    time.sleep(2)
-    sys.exit(0)
+    console.info("Asked Crafty to stop all servers and exit - waiting for it to pick up the command")
+
+    # the running crafty clears the command as soon as it starts on it
+    for x in range(30):
+        if not Remote.select().where(Remote.command == 'exit_crafty').exists():
+            console.info("Crafty is shutting down")
+            sys.exit(0)
+
+        time.sleep(1)
+
+    console.warning("Crafty didn't pick up the exit command - is it running?")
+    sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -250,8 +253,8 @@ if __name__ == '__main__':
 
         peewee.default_settings(admin_pass, admin_token)
 
-    else:
-        peewee.do_database_migrations()
+    # every migration checks before it changes anything, so this is safe on a fresh database too
+    peewee.do_database_migrations()
 
     # only import / new database tables are created do we load the rest of the things!
     from app.classes.ftp import ftp_svr_object
@@ -304,6 +307,9 @@ if __name__ == '__main__':
     # do one now...
     multi.do_host_status()
 
+    # per second cpu / memory / player samples for each running server, kept in memory
+    multi.start_metrics_sampler()
+
     # do our scheduling
     multi.reload_scheduling()
 
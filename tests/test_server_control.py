@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+from playhouse.shortcuts import model_to_dict
+
+from app.classes.models import database, peewee as db_helper, MC_settings, Server_Stats
+from app.classes.multiserv import multi
+from app.classes.handlers.admin_handler import AdminHandler
+
+COOKIE_SECRET = 'server-control-test'
+WEB_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'web')
+
+
+class FakeServer:
+    """Stands in for a running Minecraft_Server - just what the stats run and the server_control page read"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.server_id = settings.id
+        self.server_path = settings.server_path
+
+    def get_mc_server_name(self):
+        return self.settings.server_name
+
+    def check_running(self):
+        return True
+
+    def check_crashed(self):
+        return False
+
+    def get_state(self):
+        return 'running'
+
+    def check_updating(self):
+        return False
+
+    def get_world_info(self):
+        return {'world_name': 'world', 'world_size': '1.0 MB'}
+
+    def get_mc_process_stats(self):
+        return {
+            'server_start_time': '2020-01-01 00:00:00',
+            'server_running': True,
+            'cpu_usage': 1.5,
+            'memory_usage': '512.0 MB',
+            'memory_bytes': 512 * 1024 * 1024,
+            'world_name': 'world',
+            'world_size': '1.0 MB',
+            'world_bytes': 1024 * 1024,
+            'server_ip': '127.0.0.1',
+            'server_port': 25565,
+            'online': 2,
+            'max': 20,
+            'players': ['Notch', 'jeb_'],
+            'server_description': 'A Minecraft Server',
+            'server_version': '1.15.2',
+        }
+
+
+class ServerControlPageTest(AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        database.init(os.path.join(self.db_dir, 'crafty.sqlite'))
+        db_helper.create_tables()
+        db_helper.default_settings('admin', 'token')
+        db_helper.do_database_migrations()
+
+        settings = MC_settings.create(server_name='test', server_path=self.db_dir, server_jar='server.jar',
+                                      memory_max='1024', memory_min='512', additional_args='',
+                                      java_path='java', auto_start_server=False, auto_start_delay=10,
+                                      auto_start_priority=1, crash_detection=False)
+
+        self.server = FakeServer(settings)
+        entry = {'server_id': settings.id, 'server_name': settings.server_name, 'server_obj': self.server}
+
+        with multi.registry_lock:
+            multi.servers_list[settings.server_name] = entry
+            multi.servers_by_id[settings.id] = entry
+
+        multi.stats_rows = None
+        multi.do_stats_for_servers()
+
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+
+        with multi.registry_lock:
+            multi.servers_list.clear()
+            multi.servers_by_id.clear()
+            multi.server_settings.clear()
+
+        multi.stats_rows = None
+        multi.stats_snapshot = {}
+        multi.refresh_fleet_snapshot()
+
+        database.close()
+        shutil.rmtree(self.db_dir)
+
+    def get_app(self):
+        return tornado.web.Application(
+            [(r'/admin/(.*)', AdminHandler, dict(mcserver=self.server))],
+            template_path=os.path.join(WEB_ROOT, 'templates'),
+            cookie_secret=COOKIE_SECRET,
+            login_url='/'
+        )
+
+    def test_snapshot_row_matches_stats_table(self):
+        row = dict(multi.get_fleet_snapshot().mc_servers_data[self.server.server_id])
+        stored = model_to_dict(Server_Stats.get(Server_Stats.server_id == self.server.server_id))
+
+        self.assertEqual(row.pop('name'), 'test')
+        self.assertEqual(row, stored)
+
+    def test_server_control_renders_players(self):
+        cookie = tornado.web.create_signed_value(COOKIE_SECRET, 'user', json.dumps('Admin')).decode('utf-8')
+
+        response = self.fetch('/admin/server_control?id={}'.format(self.server.server_id),
+                              headers={'Cookie': 'user={}'.format(cookie)})
+
+        self.assertEqual(response.code, 200)
+        self.assertIn(b'Notch', response.body)
+        self.assertIn(b'jeb_', response.body)
+
+
+if __name__ == '__main__':
+    unittest.main()